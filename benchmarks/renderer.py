@@ -0,0 +1,107 @@
+"""Compare BodymassRenderer with the pyplot drawing it replaced: time per render and peak RSS.
+
+    python -m benchmarks.renderer [--renders 30] [--points 14 365 3650]
+
+'renderer' draws with the 'original' render profile, the same 300 dpi PNG as pyplot did;
+'renderer/telegram' with the 'telegram' one, 'pillow/telegram' with the Pillow renderer. Each variant runs in a fresh process, as a render worker does, so that peak RSS is its own.
+The first render includes figure setup and layout, it is reported apart.
+"""
+import argparse
+import functools
+import io
+import multiprocessing
+import resource
+import time
+import typing as t
+
+import numpy as np
+
+from src.datautils.challenge import Challenge
+from src.datautils.render import render_profiles
+
+CHALLENGE = Challenge(user_id='1', is_active=1, start_date='2022/01/01', end_date='2032/01/01',
+                      start_weight=100.0, target_weight=80.0)
+
+
+def _draw_with_pyplot(date, mass, file, plot_label, challenge=None, start_label='Start', target_label='Goal'):
+    """draw_plot_bodymass() as it was before BodymassRenderer, without date limits."""
+    from matplotlib import pyplot
+    from matplotlib.dates import date2num, DateFormatter
+    from src.datautils.plotting import desired_regression, _get_y_limits
+
+    x = date2num(np.asarray(date))
+    y = np.asarray(mass, dtype=np.float64)
+    fig, ax = pyplot.subplots(figsize=[8, 5])
+    if challenge:
+        desired_x, desired_y = desired_regression(challenge)
+        pyplot.plot(desired_x, desired_y, linestyle='dashed', color='red', markevery=[0, -1], marker='x')
+        for label, x_, y_ in ((start_label, desired_x[0], desired_y[0]), (target_label, desired_x[1], desired_y[1])):
+            pyplot.annotate(label, (x_, y_), color='red', ha='center', va='top', xytext=(0, -5),
+                            textcoords="offset points")
+    pyplot.ylim(*_get_y_limits(challenge, y))
+    pyplot.scatter(x, y)
+    if len(x) > 1:
+        pyplot.plot(x, np.poly1d(np.polyfit(x, y, 1))(x))
+    pyplot.ylabel(plot_label)
+    ax.xaxis.set_major_formatter(DateFormatter('%d %b'))
+    pyplot.xticks(rotation=45)
+    pyplot.grid()
+    pyplot.tight_layout()
+    pyplot.savefig(file, dpi=300, format='png')
+    pyplot.close('all')
+
+
+def _draw_with_renderer(*args, profile: str = 'original', **kwargs):
+    from src.datautils.plotting import get_renderer
+    get_renderer(render_profiles[profile]).draw(*args, **kwargs)
+
+
+def _draw_with_pillow(*args, profile: str = 'telegram', **kwargs):
+    from src.datautils.pillow_plotting import draw_plot_bodymass_pillow
+    draw_plot_bodymass_pillow(*args, profile=render_profiles[profile], **kwargs)
+
+
+VARIANTS: dict[str, t.Callable] = {
+    'pyplot': _draw_with_pyplot,
+    'renderer': _draw_with_renderer,
+    'renderer/telegram': functools.partial(_draw_with_renderer, profile='telegram'),
+    'pillow/telegram': _draw_with_pillow,
+}
+
+
+def _run(variant: str, renders: int, points: int) -> tuple[float, float, float]:
+    """:return: first render seconds, mean seconds of the others, peak RSS in MiB"""
+    if variant == 'pyplot':
+        import matplotlib
+        matplotlib.use('Agg')
+
+    rng = np.random.default_rng(0)
+    dates = np.datetime64('2022-01-01') + np.arange(points)
+    draw = VARIANTS[variant]
+    seconds = []
+    for i in range(renders):
+        masses = 100 - 0.01 * np.arange(points) + rng.normal(0, 0.5, points)
+        started = time.perf_counter()
+        draw(dates, masses, io.BytesIO(), 'Bodyweight, kg', challenge=CHALLENGE if i % 2 else None)
+        seconds.append(time.perf_counter() - started)
+    # ru_maxrss is in KiB on Linux
+    return seconds[0], float(np.mean(seconds[1:])), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--renders', type=int, default=30)
+    parser.add_argument('--points', type=int, nargs='+', default=[14, 365, 3650])
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    print(f"{'points':>7} {'variant':<18} {'first ms':>9} {'mean ms':>8} {'peak RSS MiB':>13}")
+    for points in args.points:
+        for variant in VARIANTS:
+            with context.Pool(1) as pool:
+                first_s, mean_s, peak_rss = pool.apply(_run, (variant, args.renders, points))
+            print(f"{points:>7} {variant:<18} {first_s * 1000:>9.0f} {mean_s * 1000:>8.0f} {peak_rss:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Bot startup: time to import main.py, where it goes (`python -X importtime`), and RSS once the services are up.
+
+    python -m benchmarks.startup [--runs 5] [--top 12]
+
+Each run is a fresh interpreter that imports main and runs start_services() on an empty database, everything the
+bot does before it polls. 'numpy preloaded' imports NumPy first, as main did before the data modules loaded it
+lazily; its import time includes NumPy's. Import and RSS figures are medians over the runs, the slowest imports those of the last run.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import typing as t
+
+VARIANTS: dict[str, list[str]] = {
+    'lazy': [],
+    'numpy preloaded': ['numpy'],
+}
+
+
+def _boot(preload: list[str]) -> None:
+    """Runs in the measured interpreter: prints import seconds, peak RSS and the heavy modules that got loaded."""
+    import asyncio
+    import importlib
+    import resource
+    import tempfile
+    from pathlib import Path
+
+    started = time.perf_counter()
+    for module in preload:
+        importlib.import_module(module)
+    import main
+    import_seconds = time.perf_counter() - started
+
+    async def boot():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            await main.start_services(str(Path(tmp_dir) / 'startup.sqlite'))
+            # ru_maxrss is in KiB on Linux
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            await main.stop_services()
+        return rss
+
+    rss = asyncio.run(boot())
+    # numpy.core only shows up once NumPy is actually loaded, not while it is a lazy module
+    loaded = [name for name in ('numpy.core', 'matplotlib', 'PIL') if name in sys.modules]
+    print(json.dumps({'import_seconds': import_seconds, 'rss': rss, 'loaded': loaded}))
+
+
+def _import_times(stderr: str) -> list[tuple[int, str]]:
+    """Cumulative microseconds of the modules main imports directly, from `-X importtime` output."""
+    lines = [line.split('|') for line in stderr.splitlines() if line.startswith('import time:')]
+    times = []
+    for position, (_, cumulative, name) in enumerate(lines):
+        if name.strip() != 'main':
+            continue
+        # Children are listed before their parent, two spaces deeper
+        for _, child_cumulative, child_name in reversed(lines[:position]):
+            depth = (len(child_name) - len(child_name.lstrip()) - 1) // 2
+            if depth == 0:
+                break
+            if depth == 1:
+                times.append((int(child_cumulative), child_name.strip()))
+        times.append((int(cumulative), 'main'))
+    return sorted(times, reverse=True)
+
+
+def _run(preload: list[str]) -> tuple[dict[str, t.Any], list[tuple[int, str]]]:
+    # config.py refuses to load without a token, none is used
+    env = dict(os.environ, TELEGRAM_TOKEN=os.environ.get('TELEGRAM_TOKEN', '0:startup-benchmark'))
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'benchmarks.startup', '--boot', *preload],
+                             env=env, capture_output=True, text=True, check=True)
+    return json.loads(process.stdout.splitlines()[-1]), _import_times(process.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=12)
+    parser.add_argument('--boot', nargs='*', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.boot is not None:
+        return _boot(args.boot)
+
+    print(f"{'variant':<16} {'import main ms':>15} {'RSS after boot MiB':>19}  loaded")
+    slowest_imports = {}
+    for variant, preload in VARIANTS.items():
+        results = []
+        for _ in range(args.runs):
+            result, slowest_imports[variant] = _run(preload)
+            results.append(result)
+        import_ms = statistics.median(result['import_seconds'] for result in results) * 1000
+        rss = statistics.median(result['rss'] for result in results)
+        print(f"{variant:<16} {import_ms:>15.0f} {rss:>19.0f}  {', '.join(results[-1]['loaded']) or '-'}")
+
+    for variant, import_times in slowest_imports.items():
+        print(f"\nSlowest imports of main, {variant} (-X importtime, cumulative):")
+        for microseconds, name in import_times[:args.top]:
+            print(f"{microseconds / 1000:>8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
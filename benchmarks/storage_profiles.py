@@ -0,0 +1,92 @@
+"""Compare SQLite storage profiles on the bot's own queries.
+
+    python -m benchmarks.storage_profiles [--writes 500] [--reads 2000]
+
+write-heavy: one commit per body mass record, like users sending their weight;
+read-heavy: concurrent series reads, like plot requests, while year long CSV imports are being written.
+Lock errors are reads or imports that failed with "database is locked".
+"""
+import argparse
+import asyncio
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from src.datautils.bodymass import add_bodymass_record, fetch_user_bodymass_series, import_bodymass_records
+from src.datautils.migrations import migrate_database
+from src.datautils.pool import open_pool, close_pool, storage_profiles, StorageProfile
+
+USERS = 50
+HISTORY_DAYS = 365
+
+
+async def _write_heavy(writes: int) -> float:
+    started = time.perf_counter()
+    for i in range(writes):
+        await add_bodymass_record(i % USERS, date(2023, 1, 1) + timedelta(days=i // USERS), 80.0 + i % 7 / 10)
+    return writes / (time.perf_counter() - started)
+
+
+async def _read_heavy(reads: int, concurrency: int = 4) -> tuple[float, float, int]:
+    for user_id in range(USERS):
+        await import_bodymass_records(user_id, {(date(2022, 1, 1) + timedelta(days=day)).strftime('%Y/%m/%d'): 80.0
+                                                for day in range(HISTORY_DAYS)})
+
+    latencies = []
+    locked = 0
+
+    async def reader(count: int):
+        nonlocal locked
+        for i in range(count):
+            started = time.perf_counter()
+            try:
+                await fetch_user_bodymass_series(i % USERS)
+            except sqlite3.OperationalError:
+                # "database is locked": without WAL a reader and the committing writer exclude each other
+                locked += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    async def importer():
+        nonlocal locked
+        records = {(date(2020, 1, 1) + timedelta(days=day)).strftime('%Y/%m/%d'): 70.0 for day in range(HISTORY_DAYS)}
+        for user_id in range(USERS, USERS * 2):
+            try:
+                await import_bodymass_records(user_id, records)
+            except sqlite3.OperationalError:
+                locked += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(importer(), *(reader(reads // concurrency) for _ in range(concurrency)))
+    return len(latencies) / (time.perf_counter() - started), max(latencies, default=0.0), locked
+
+
+async def _run(profile: StorageProfile, writes: int, reads: int) -> tuple[float, float, float, int]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = str(Path(tmp_dir) / 'benchmark.sqlite')
+        migrate_database(db_path)
+        await open_pool(db_path, readers=4, profile=profile)
+        try:
+            writes_per_s = await _write_heavy(writes)
+            reads_per_s, max_read_s, locked = await _read_heavy(reads)
+        finally:
+            await close_pool()
+    return writes_per_s, reads_per_s, max_read_s, locked
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writes', type=int, default=500)
+    parser.add_argument('--reads', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'profile':<16} {'writes/s':>10} {'reads/s':>10} {'max read ms':>12} {'lock errors':>12}")
+    for name, profile in storage_profiles.items():
+        writes_per_s, reads_per_s, max_read_s, locked = asyncio.run(_run(profile, args.writes, args.reads))
+        print(f"{name:<16} {writes_per_s:>10.0f} {reads_per_s:>10.0f} {max_read_s * 1000:>12.1f} {locked:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import asyncio
+import contextlib
+from datetime import datetime
+
+import pytest
+from aiohttp import web
+
+from db_tests import run_with_pool, fetch_rows
+from src.datautils.bodymass import CSVParsingError, parse_bodymass_csv, import_bodymass_records, \
+    add_bodymass_record, CSVFileTooBigError, download_csv_lines, \
+    user_bodymass_data_from_csv_url, user_bodymass_data_to_csv
+
+CSV_CONTENT = '2023/03/01,80.5\r\n2023/03/02,80.1\r\n2023/03/03,79.9'
+
+
+@contextlib.asynccontextmanager
+async def _csv_server():
+    """A local stand-in for the Telegram file server."""
+    async def csv_file(_):
+        return web.Response(text=CSV_CONTENT)
+
+    async def big_file(_):
+        return web.Response(body=b'2023/03/01,80.5\n' * 1000)
+
+    async def slow_file(request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        await response.write(b'2023/03/01,80.5\n')
+        await asyncio.sleep(2)
+        return response
+
+    app = web.Application()
+    app.router.add_get('/file.csv', csv_file)
+    app.router.add_get('/big.csv', big_file)
+    app.router.add_get('/slow.csv', slow_file)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        await runner.cleanup()
+
+
+def test_parse_bodymass_csv():
+    lines = [
+        '2023/03/01,80.5',
+        '2023/3/2,80.1',
+        '2023/03/01,80.4',
+    ]
+    assert parse_bodymass_csv(lines, 1000) == {'2023/03/01': 80.4, '2023/03/02': 80.1}
+
+
+def test_parse_bodymass_csv_invalid_rows():
+    lines = [
+        '2023/03/01,80.5',
+        '2023-03-02,80.1',
+        '2023/03/03,-1',
+        '2023/03/04,80.0',
+        '2023/03/05,1000',
+    ]
+    with pytest.raises(CSVParsingError) as exc_info:
+        parse_bodymass_csv(lines, 1000)
+
+    assert exc_info.value.line_number == 2
+    assert exc_info.value.rejected == 3
+
+
+def test_import_bodymass_records():
+    async def scenario():
+        await add_bodymass_record(1, datetime(2023, 3, 1), 81.0)
+        await add_bodymass_record(1, datetime(2023, 3, 10), 79.0)
+        await add_bodymass_record(2, datetime(2023, 3, 2), 60.0)
+
+        report = await import_bodymass_records(1, {'2023/03/01': 80.5, '2023/03/02': 80.1, '2023/03/03': 80.0})
+        rows = await fetch_rows(1)
+        return report, rows
+
+    report, rows = run_with_pool(scenario)
+    assert report.inserted == 2
+    assert report.replaced == 1
+    assert rows == [('2023-03-01', 80.5), ('2023-03-02', 80.1), ('2023-03-03', 80.0), ('2023-03-10', 79.0)]
+
+
+def test_download_csv_lines():
+    async def scenario():
+        async with _csv_server() as url:
+            return await download_csv_lines(f'{url}/file.csv', max_file_size=1024, timeout=5)
+
+    assert asyncio.run(scenario()) == ['2023/03/01,80.5', '2023/03/02,80.1', '2023/03/03,79.9']
+
+
+def test_download_csv_lines_size_limit():
+    async def scenario():
+        async with _csv_server() as url:
+            with pytest.raises(CSVFileTooBigError):
+                await download_csv_lines(f'{url}/big.csv', max_file_size=1024, timeout=5)
+
+    asyncio.run(scenario())
+
+
+def test_download_csv_lines_timeout():
+    async def scenario():
+        async with _csv_server() as url:
+            with pytest.raises(asyncio.TimeoutError):
+                await download_csv_lines(f'{url}/slow.csv', max_file_size=1024, timeout=0.5)
+
+    asyncio.run(scenario())
+
+
+def test_user_bodymass_data_from_csv_url():
+    async def scenario():
+        async with _csv_server() as url:
+            report = await user_bodymass_data_from_csv_url(1, f'{url}/file.csv', 1000, max_file_size=1024)
+        return report, await fetch_rows(1)
+
+    report, rows = run_with_pool(scenario)
+    assert report.inserted == 3
+    assert rows == [('2023-03-01', 80.5), ('2023-03-02', 80.1), ('2023-03-03', 79.9)]
+
+
+def test_user_bodymass_data_to_csv():
+    async def scenario():
+        empty = await user_bodymass_data_to_csv(1)
+        await import_bodymass_records(1, {'2023/03/01': 80.5, '2023/03/02': 80.1})
+        return empty, await user_bodymass_data_to_csv(1)
+
+    empty, csv_file = run_with_pool(scenario)
+    assert empty == b''
+    assert csv_file == b'2023/03/01,80.5\r\n2023/03/02,80.1\r\n'
+    assert parse_bodymass_csv(csv_file.decode('utf-8').splitlines(), 1000) == {'2023/03/01': 80.5,
+                                                                              '2023/03/02': 80.1}
+
+
+if __name__ == "__main__":
+    test_parse_bodymass_csv()
+    test_parse_bodymass_csv_invalid_rows()
+    test_import_bodymass_records()
+    test_download_csv_lines()
+    test_download_csv_lines_size_limit()
+    test_download_csv_lines_timeout()
+    test_user_bodymass_data_from_csv_url()
+    test_user_bodymass_data_to_csv()
@@ -1,13 +1,10 @@
 --
--- File generated with SQLiteStudio v3.4.15 on Thu Feb 6 16:49:53 2025
+-- Current schema, used to create a new database.
+-- Existing databases are upgraded by src/datautils/migrations.py: a change here needs a migration there.
 --
--- Text encoding used: UTF-8
---
-PRAGMA foreign_keys = off;
-BEGIN TRANSACTION;
 
 -- Table: users_challenges
-CREATE TABLE IF NOT EXISTS users_challenges (
+CREATE TABLE users_challenges (
     user_id       TEXT (32) PRIMARY KEY
                             UNIQUE ON CONFLICT REPLACE,
     is_active     INTEGER   NOT NULL,
@@ -18,43 +15,39 @@ CREATE TABLE IF NOT EXISTS users_challenges (
 );
 
 
--- Table: users_conversation
-CREATE TABLE IF NOT EXISTS users_conversation (
-    user_id            TEXT (32) UNIQUE ON CONFLICT REPLACE,
-    conversation_state TEXT
-);
-
-
--- Table: users_language
-CREATE TABLE IF NOT EXISTS users_language (
-    user_id  TEXT (32) PRIMARY KEY
-                       UNIQUE ON CONFLICT REPLACE,
-    language TEXT (32) NOT NULL
+-- Table: users_context
+CREATE TABLE users_context (
+    user_id            TEXT (32) PRIMARY KEY,
+    conversation_state TEXT      NOT NULL,
+    language           TEXT (32),
+    challenge_draft    TEXT,
+    text_only          INTEGER   NOT NULL
+                                 DEFAULT 0
 );
 
 
 -- Table: users_mass
-CREATE TABLE IF NOT EXISTS users_mass (
-    record_id INTEGER,
-    user_id   TEXT (32),
-    date      DATE      NOT NULL,
-    body_mass REAL,
+-- day: days since 1970-01-01. Records are clustered by (user_id, day), so a user's range is read sequentially.
+CREATE TABLE users_mass (
+    user_id   INTEGER NOT NULL,
+    day       INTEGER NOT NULL,
+    body_mass REAL    NOT NULL,
     PRIMARY KEY (
-        record_id AUTOINCREMENT
-    ),
-    CONSTRAINT user_date_constraint UNIQUE (
         user_id,
-        date
+        day
     )
     ON CONFLICT REPLACE
+)
+WITHOUT ROWID;
+
+
+-- Table: users_mass_stats
+-- Least squares sums over each user's users_mass rows (x: day, y: body_mass), kept in step by the bot.
+CREATE TABLE users_mass_stats (
+    user_id INTEGER PRIMARY KEY,
+    n       INTEGER NOT NULL,
+    sum_x   INTEGER NOT NULL,
+    sum_y   REAL    NOT NULL,
+    sum_xy  REAL    NOT NULL,
+    sum_xx  INTEGER NOT NULL
 );
-
-
--- Index: user_id_idx
-CREATE INDEX IF NOT EXISTS user_id_idx ON users_mass (
-    user_id
-);
-
-
-COMMIT TRANSACTION;
-PRAGMA foreign_keys = on;
@@ -1,7 +1,13 @@
-from datetime import datetime
+from datetime import datetime, date
+
+import numpy as np
+import pytest
+
 # noinspection PyProtectedMember
 from src.datautils.bodymass import _get_date_limits
 from src.datautils.challenge import Challenge
+from src.datautils.dates import parse_date, format_date, parse_date_column, format_date_column, date_to_day, \
+    day_to_date, days_to_date_column, date_column_to_days, date_limits_to_days
 from freezegun import freeze_time
 
 
@@ -95,5 +101,52 @@ def test_get_date_limits():
         assert res == expected_, f"{idx}. inputs: {input_} \n {res} != {expected_}"
 
 
+def test_date_limits_to_days():
+    INPUTS = [
+        (datetime(2023, 2, 10), datetime(2023, 3, 20)),
+        (datetime(2023, 2, 22, 15, 30), datetime(2023, 3, 8, 15, 30)),
+        (datetime(2023, 2, 22, 0, 0, 1), datetime(2023, 3, 8, 23, 59)),
+    ]
+    EXPECTED_RESULTS = [
+        (date_to_day(date(2023, 2, 10)), date_to_day(date(2023, 3, 20))),
+        (date_to_day(date(2023, 2, 23)), date_to_day(date(2023, 3, 8))),
+        (date_to_day(date(2023, 2, 23)), date_to_day(date(2023, 3, 8))),
+    ]
+
+    for idx, [input_, expected_] in enumerate(zip(INPUTS, EXPECTED_RESULTS)):
+        res = date_limits_to_days(input_)
+        assert res == expected_, f"{idx}. inputs: {input_} \n {res} != {expected_}"
+
+
+def test_parse_date_column():
+    dates = parse_date_column(["2023/02/28", "2024/02/29", "2023/12/31"])
+    assert dates.dtype == np.dtype('datetime64[D]')
+    assert dates.tolist() == [datetime(2023, 2, 28).date(), datetime(2024, 2, 29).date(), datetime(2023, 12, 31).date()]
+    assert format_date_column(dates) == ["2023/02/28", "2024/02/29", "2023/12/31"]
+    assert len(parse_date_column([])) == 0
+
+    with pytest.raises(ValueError):
+        parse_date_column(["2023/02/30"])
+
+
+def test_day_numbers():
+    assert date_to_day(date(1970, 1, 1)) == 0
+    assert date_to_day(datetime(2023, 3, 1, 15, 30)) == 19417
+    assert day_to_date(19417) == date(2023, 3, 1)
+
+    dates = days_to_date_column([0, 19417])
+    assert format_date_column(dates) == ["1970/01/01", "2023/03/01"]
+    assert date_column_to_days(dates).tolist() == [0, 19417]
+
+
+def test_parse_date():
+    assert parse_date("2023/02/10") is parse_date("2023/02/10")
+    assert format_date(parse_date("2023/02/10")) == "2023/02/10"
+
+
 if __name__ == "__main__":
     test_get_date_limits()
+    test_date_limits_to_days()
+    test_parse_date_column()
+    test_day_numbers()
+    test_parse_date()
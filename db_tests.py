@@ -0,0 +1,421 @@
+import asyncio
+import sqlite3
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.datautils.bodymass import add_bodymass_record, fetch_user_bodymass_series, import_bodymass_records, \
+    delete_user_bodymass_data
+from src.datautils.challenge import Challenge, insert_challenge, get_challenge
+from src.datautils.conversation import get_conversation_data, write_conversation_data, ConversationState, Language, \
+    DEFAULT_LANGUAGE, start_conversation_cache, stop_conversation_cache
+from src.datautils.migrations import migrate_database, SCHEMA_VERSION
+from src.datautils.pool import ConnectionPool, open_pool, close_pool, get_pool, StorageProfile, storage_profiles
+from src.datautils.trend import RegressionSums, fetch_user_regression_sums
+
+
+def run_with_pool(coroutine_function, readers: int = 2, profile: StorageProfile = StorageProfile()):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = str(Path(tmp_dir) / 'test.sqlite')
+        migrate_database(db_path)
+
+        async def run():
+            await open_pool(db_path, readers=readers, profile=profile)
+            try:
+                return await coroutine_function()
+            finally:
+                await close_pool()
+
+        return asyncio.run(run())
+
+
+async def fetch_rows(user_id: int, date_limits=None) -> list[tuple[str, float]]:
+    dates, masses = await fetch_user_bodymass_series(user_id, date_limits)
+    assert dates.dtype == np.dtype('datetime64[D]') and masses.dtype == np.float64
+    return list(zip(np.datetime_as_string(dates).tolist(), masses.tolist()))
+
+
+def test_pool_counters():
+    async def scenario():
+        pool = get_pool()
+        async with pool.reader():
+            async with pool.reader():
+                pass
+
+        async def hold_writer():
+            async with pool.writer():
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(hold_writer(), hold_writer())
+        return pool.stats
+
+    stats = run_with_pool(scenario)
+    assert stats.reader_hits == 2
+    assert stats.reader_waits == 0
+    assert stats.writer_hits == 1
+    assert stats.writer_waits == 1
+
+
+def test_pool_reader_waits_when_exhausted():
+    async def scenario():
+        pool = get_pool()
+
+        async def hold_reader():
+            async with pool.reader():
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(hold_reader() for _ in range(3)))
+        return pool.stats
+
+    stats = run_with_pool(scenario, readers=1)
+    assert stats.reader_hits == 1
+    assert stats.reader_waits == 2
+
+
+def test_storage_profile_pragmas():
+    async def scenario():
+        pragmas = {}
+        async with get_pool().reader() as db:
+            for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'temp_store', 'cache_size'):
+                async with db.execute(f"PRAGMA {pragma}") as cursor:
+                    (pragmas[pragma],) = await cursor.fetchone()
+        return pragmas
+
+    assert run_with_pool(scenario) == {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000,
+                                       'temp_store': 2, 'cache_size': -8192}
+    assert run_with_pool(scenario, profile=storage_profiles['sqlite_defaults'])['journal_mode'] == 'delete'
+
+
+def test_readers_during_write():
+    async def scenario():
+        pool = get_pool()
+        await add_bodymass_record(1, datetime(2023, 3, 1), 80.5)
+        async with pool.writer() as db:
+            await db.execute("INSERT INTO users_mass (user_id, day, body_mass) VALUES (1, 19418, 80.1)")
+            # The write transaction is open: readers see the last committed state without waiting
+            rows_during_write = await fetch_rows(1)
+            await db.commit()
+
+        checkpointed = await pool.checkpoint()
+        return rows_during_write, await fetch_rows(1), checkpointed, pool.stats
+
+    rows_during_write, rows, checkpointed, stats = run_with_pool(scenario)
+    assert rows_during_write == [('2023-03-01', 80.5)]
+    assert rows == [('2023-03-01', 80.5), ('2023-03-02', 80.1)]
+    assert checkpointed > 0
+    assert stats.checkpoints == 1 and stats.checkpointed_pages == checkpointed
+
+
+def test_pool_shared_by_datautils():
+    async def scenario():
+        await add_bodymass_record(1, datetime(2023, 3, 1), 80.5)
+        await add_bodymass_record(1, datetime(2023, 3, 2), 80.1)
+        await add_bodymass_record(2, datetime(2023, 3, 2), 60.0)
+        return await fetch_rows(1)
+
+    rows = run_with_pool(scenario)
+    assert rows == [('2023-03-01', 80.5), ('2023-03-02', 80.1)]
+
+
+def test_fetch_user_bodymass_series_date_limits():
+    async def scenario():
+        for day in range(1, 29):
+            await add_bodymass_record(1, datetime(2023, 2, day), 80 + day / 10)
+        await add_bodymass_record(2, datetime(2023, 2, 10), 60.0)
+
+        rows = await fetch_rows(1, (datetime(2023, 2, 9, 12), datetime(2023, 2, 12, 12)))
+        async with get_pool().reader() as db:
+            async with db.execute("EXPLAIN QUERY PLAN SELECT day, body_mass FROM users_mass "
+                                  "WHERE user_id = ? AND day BETWEEN ? AND ? ORDER BY day ASC",
+                                  (1, 19398, 19400)) as cursor:
+                plan = ' '.join(row[-1] for row in await cursor.fetchall())
+        return rows, plan, await fetch_user_regression_sums(1), await fetch_user_regression_sums(3)
+
+    rows, plan, sums, empty_sums = run_with_pool(scenario)
+    assert rows == [('2023-02-10', 81.0), ('2023-02-11', 81.1), ('2023-02-12', 81.2)]
+    assert 'PRIMARY KEY (user_id=? AND day>? AND day<?)' in plan, plan
+    assert 'TEMP B-TREE' not in plan, plan
+    assert sums.n == 28 and abs(sums.mean - 81.45) < 1e-9
+    assert empty_sums.n == 0
+
+
+def test_fetch_user_bodymass_series_empty():
+    async def scenario():
+        return await fetch_user_bodymass_series(1)
+
+    dates, masses = run_with_pool(scenario)
+    assert dates.dtype == np.dtype('datetime64[D]') and len(dates) == 0
+    assert masses.dtype == np.float64 and len(masses) == 0
+
+
+SCHEMA_TABLES = [('table', 'users_challenges'), ('table', 'users_context'), ('table', 'users_mass'),
+                 ('table', 'users_mass_stats')]
+
+
+def _schema(db_path: str) -> list[tuple[str, str]]:
+    with sqlite3.connect(db_path) as db:
+        objects = db.execute("SELECT type, name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%' ORDER BY name"
+                             ).fetchall()
+    db.close()
+    return objects
+
+
+def test_migrate_new_database():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = str(Path(tmp_dir) / 'test.sqlite')
+        assert migrate_database(db_path) == (0, SCHEMA_VERSION)
+        assert migrate_database(db_path) == (SCHEMA_VERSION, SCHEMA_VERSION)
+        assert _schema(db_path) == SCHEMA_TABLES
+
+
+def test_migrate_unversioned_database():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = str(Path(tmp_dir) / 'test.sqlite')
+        with sqlite3.connect(db_path) as db:
+            db.execute("CREATE TABLE users_conversation (user_id TEXT (32) UNIQUE ON CONFLICT REPLACE, "
+                       "conversation_state TEXT)")
+            db.execute("CREATE TABLE users_language (user_id TEXT (32) PRIMARY KEY, language TEXT (32) NOT NULL)")
+            db.execute("CREATE TABLE users_mass (record_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT (32), "
+                       "date DATE NOT NULL, body_mass REAL, UNIQUE (user_id, date) ON CONFLICT REPLACE)")
+            db.execute("CREATE INDEX user_id_idx ON users_mass (user_id)")
+            db.execute("INSERT INTO users_conversation VALUES ('1', 'awaiting_body_weight')")
+            db.execute("INSERT INTO users_language VALUES ('1', 'russian')")
+            # Language chosen, no conversation state saved yet
+            db.execute("INSERT INTO users_language VALUES ('3', 'russian')")
+            db.executemany("INSERT INTO users_mass (user_id, date, body_mass) VALUES (?, ?, ?)",
+                           [('1', '2023/03/02', 80.1), ('1', '2023/03/01', 80.5), ('2', '2023/03/01', 60.0),
+                            ('1', 'not a date', 80.0), ('2', '2023/03/02', None)])
+        db.close()
+
+        assert migrate_database(db_path) == (0, SCHEMA_VERSION)
+        assert migrate_database(db_path) == (SCHEMA_VERSION, SCHEMA_VERSION)
+
+        with sqlite3.connect(db_path) as db:
+            rows = db.execute("SELECT user_id, day, body_mass FROM users_mass").fetchall()
+            context = db.execute("SELECT user_id, conversation_state, language, text_only FROM users_context "
+                                 "ORDER BY user_id").fetchall()
+            stats = db.execute("SELECT user_id, n, sum_x, sum_y FROM users_mass_stats").fetchall()
+            # Vacuumed after users_mass was rewritten
+            (free_pages,), = db.execute("PRAGMA freelist_count")
+        db.close()
+
+        # Same tables as a new database. No rowid b-tree and no separate index: the primary key is the table
+        assert _schema(db_path) == SCHEMA_TABLES
+
+    assert rows == [(1, 19417, 80.5), (1, 19418, 80.1), (2, 19417, 60.0)]
+    assert context == [('1', 'awaiting_body_weight', 'russian', 0), ('3', 'init', 'russian', 0)]
+    assert stats == [(1, 2, 19417 + 19418, 80.5 + 80.1), (2, 1, 19417, 60.0)]
+    assert free_pages == 0
+
+
+def test_migrate_newer_database():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = str(Path(tmp_dir) / 'test.sqlite')
+        with sqlite3.connect(db_path) as db:
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+        db.close()
+
+        with pytest.raises(RuntimeError):
+            migrate_database(db_path)
+
+
+def test_pool_close():
+    async def scenario():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pool = ConnectionPool(str(Path(tmp_dir) / 'test.sqlite'), readers=1)
+            await pool.open()
+            assert pool.is_open
+            await pool.close()
+            assert not pool.is_open
+            await pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_regression_sums_maintained():
+    async def scenario():
+        await add_bodymass_record(1, datetime(2023, 3, 1), 80.0)
+        await add_bodymass_record(1, datetime(2023, 3, 2), 79.0)
+        # Replaces the record of the day
+        await add_bodymass_record(1, datetime(2023, 3, 2), 79.6)
+        await import_bodymass_records(1, {'2023/03/01': 80.2, '2023/03/05': 79.1, '2023/03/08': 78.8})
+        await add_bodymass_record(2, datetime(2023, 3, 1), 60.0)
+
+        sums = await fetch_user_regression_sums(1)
+        dates, masses = await fetch_user_bodymass_series(1)
+        await delete_user_bodymass_data(1)
+        return sums, dates, masses, await fetch_user_regression_sums(1), await fetch_user_regression_sums(2)
+
+    sums, dates, masses, deleted, other_user = run_with_pool(scenario)
+    assert sums.n == len(masses) == 4
+    assert np.isclose(sums.mean, masses.mean())
+    assert np.isclose(sums.slope, np.polyfit(dates.astype(np.int64), masses, 1)[0])
+    assert deleted == RegressionSums() and deleted.slope is None
+    assert other_user.n == 1 and other_user.slope is None
+
+
+def test_challenge_values_are_parameters():
+    async def scenario():
+        challenge = Challenge(user_id='3', is_active=1, start_date="2023/03/01'); DROP TABLE users_mass; --",
+                              end_date='2023/04/01', start_weight=90, target_weight=85.5)
+        await insert_challenge(challenge)
+        await add_bodymass_record(3, datetime(2023, 3, 1), 90)
+        return challenge, await get_challenge(3), await fetch_rows(3)
+
+    challenge, stored, rows = run_with_pool(scenario)
+    assert stored == challenge
+    assert rows == [('2023-03-01', 90.0)]
+
+
+def test_conversation_data_roundtrip():
+    async def scenario():
+        user_data = await get_conversation_data(42)
+        assert user_data['conversation_state'] == ConversationState.init
+        assert user_data['language'] == DEFAULT_LANGUAGE
+        assert user_data['challenge_draft'] is None
+        assert user_data['text_only'] is False
+        assert not user_data.is_dirty
+
+        user_data['conversation_state'] = ConversationState.awaiting_starting_date
+        user_data['language'] = Language.russian
+        user_data['text_only'] = True
+        user_data['challenge_draft'] = Challenge(user_id='42', start_weight=90.5)
+        assert user_data.is_dirty
+        await write_conversation_data(42, user_data)
+        assert not user_data.is_dirty
+
+        user_data['challenge_draft'].start_date = '2023/03/01'
+        assert user_data.is_dirty
+        await write_conversation_data(42, user_data)
+
+        return await get_conversation_data(42)
+
+    user_data = run_with_pool(scenario)
+    assert user_data['conversation_state'] == ConversationState.awaiting_starting_date
+    assert user_data['language'] == Language.russian
+    assert user_data['challenge_draft'] == Challenge(user_id='42', start_weight=90.5, start_date='2023/03/01')
+    assert user_data['text_only'] is True
+    assert not user_data.is_dirty
+
+
+def test_conversation_data_clean_is_not_written():
+    async def scenario():
+        writer = get_pool()._writer
+        user_data = await get_conversation_data(7)
+        user_data['conversation_state'] = ConversationState.init
+        await write_conversation_data(7, user_data)
+        return writer.total_changes
+
+    assert run_with_pool(scenario) == 0
+
+
+def test_conversation_cache_write_behind():
+    async def scenario():
+        writer = get_pool()._writer
+        cache = start_conversation_cache(max_size=2, flush_interval_ms=60 * 1000)
+        try:
+            for user_id in (1, 2, 3):
+                user_data = await get_conversation_data(user_id)
+                user_data['conversation_state'] = ConversationState.awaiting_body_weight
+                await write_conversation_data(user_id, user_data)
+
+            # Nothing is written until the flush, and dirty entries are not evicted
+            assert writer.total_changes == 0
+            assert len(cache) == 3
+            assert cache.dirty_count == 3
+            cached = await get_conversation_data(3)
+            assert cached == user_data and cached is not user_data and cached.is_dirty
+            assert cache.stats.hits == 1
+
+            await cache.flush()
+            assert writer.total_changes == 3
+            assert cache.dirty_count == 0
+            assert len(cache) == 2
+            assert cache.stats.flushes == 1
+        finally:
+            stats = await stop_conversation_cache()
+
+        assert stats.rows_flushed == 3
+        return [(await get_conversation_data(user_id))['conversation_state'] for user_id in (1, 2, 3)]
+
+    assert run_with_pool(scenario) == [ConversationState.awaiting_body_weight] * 3
+
+
+def test_conversation_cache_flushed_on_stop():
+    async def scenario():
+        start_conversation_cache(flush_interval_ms=60 * 1000)
+        user_data = await get_conversation_data(5)
+        user_data['language'] = Language.russian
+        await write_conversation_data(5, user_data)
+        await stop_conversation_cache()
+        return await get_conversation_data(5)
+
+    assert run_with_pool(scenario)['language'] == Language.russian
+
+
+def test_conversation_cache_hands_out_copies():
+    async def scenario():
+        start_conversation_cache(flush_interval_ms=60 * 1000)
+        try:
+            user_data = await get_conversation_data(6)
+            user_data['challenge_draft'] = Challenge(user_id='6', start_weight=90.0)
+            await write_conversation_data(6, user_data)
+
+            # A handler that fails after changing the context never writes it
+            failed = await get_conversation_data(6)
+            failed['conversation_state'] = ConversationState.awaiting_target_date
+            failed['challenge_draft'].start_weight = 0.0
+            return await get_conversation_data(6)
+        finally:
+            await stop_conversation_cache()
+
+    user_data = run_with_pool(scenario)
+    assert user_data['conversation_state'] == ConversationState.init
+    assert user_data['challenge_draft'] == Challenge(user_id='6', start_weight=90.0)
+
+
+def test_conversation_cache_change_reverted_before_flush():
+    async def scenario():
+        start_conversation_cache(flush_interval_ms=60 * 1000)
+        try:
+            user_data = await get_conversation_data(8)
+            user_data['conversation_state'] = ConversationState.awaiting_body_weight
+            await write_conversation_data(8, user_data)
+
+            # Back to the flushed state within the same flush interval
+            user_data = await get_conversation_data(8)
+            user_data['conversation_state'] = ConversationState.init
+            await write_conversation_data(8, user_data)
+            cached = await get_conversation_data(8)
+        finally:
+            await stop_conversation_cache()
+        return cached, await get_conversation_data(8)
+
+    cached, stored = run_with_pool(scenario)
+    assert cached['conversation_state'] == ConversationState.init
+    assert stored['conversation_state'] == ConversationState.init
+
+
+if __name__ == "__main__":
+    test_pool_counters()
+    test_pool_reader_waits_when_exhausted()
+    test_storage_profile_pragmas()
+    test_readers_during_write()
+    test_pool_shared_by_datautils()
+    test_fetch_user_bodymass_series_date_limits()
+    test_fetch_user_bodymass_series_empty()
+    test_migrate_new_database()
+    test_migrate_unversioned_database()
+    test_migrate_newer_database()
+    test_pool_close()
+    test_regression_sums_maintained()
+    test_challenge_values_are_parameters()
+    test_conversation_data_roundtrip()
+    test_conversation_data_clean_is_not_written()
+    test_conversation_cache_write_behind()
+    test_conversation_cache_flushed_on_stop()
+    test_conversation_cache_hands_out_copies()
+    test_conversation_cache_change_reverted_before_flush()
@@ -1,12 +1,20 @@
 import inspect
+import io
 import math
+import subprocess
 import sys
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
 
 import numpy
+from PIL import Image
 
-from src.datautils.bodymass import draw_plot_bodymass
+from src.datautils.downsample import lttb
+from src.datautils.pillow_plotting import draw_plot_bodymass_pillow
+from src.datautils.plotting import draw_plot_bodymass, BodymassRenderer
+from src.datautils.render import render_profiles
+from src.datautils.sparkline import sparkline, SPARKLINE_BLOCKS
 from src.datautils.challenge import Challenge, get_desired_speed_per_week
 
 SAVE_DIR = 'data/tmp'
@@ -297,6 +305,155 @@ def test_date_distribution():
     print('Result saved to', file_path)
 
 
+def test_lttb():
+    print(f"Running {_get_funcname()}...", )
+
+    rng = numpy.random.default_rng(0)
+    x = numpy.arange(5000, dtype=numpy.float64)
+    y = 90 + 5 * numpy.sin(x / 200) + rng.normal(0, 0.3, len(x))
+    y[1234] = 120
+
+    kept = lttb(x, y, 300)
+    assert len(kept) <= 302 and numpy.all(numpy.diff(kept) > 0)
+    assert {0, len(x) - 1, int(numpy.argmin(y)), 1234} <= set(kept.tolist())
+    assert numpy.array_equal(lttb(x[:300], y[:300], 300), numpy.arange(300))
+
+
+def test_sparkline():
+    print(f"Running {_get_funcname()}...", )
+
+    dates = numpy.datetime64('2023-03-01') + numpy.array([0, 1, 2, 4, 5, 13])
+    line = sparkline(dates, numpy.array([80.0, 79.5, 79.8, 79.0, 78.6, 78.0]))
+    # A block per day, gaps for the days without records
+    assert line == '█▆▇ ▅▃       ▁'
+    assert sparkline(dates[:0], numpy.array([])) == ''
+    assert sparkline(dates[:2], numpy.array([80.0, 80.0])) == SPARKLINE_BLOCKS[3] * 2
+
+    dates = numpy.arange('2020-01-01', '2023-01-01', dtype='datetime64[D]')
+    line = sparkline(dates, 100 - 0.01 * numpy.arange(len(dates)), width=20)
+    assert len(line) == 20 and line[0] == SPARKLINE_BLOCKS[-1] and line[-1] == SPARKLINE_BLOCKS[0]
+    print(line)
+
+
+def test_long_history_downsampled():
+    print(f"Running {_get_funcname()}...", )
+
+    rng = numpy.random.default_rng(1)
+    dates = numpy.arange('2020-01-01', '2023-01-01', dtype='datetime64[D]')
+    measurements = 100 - 0.01 * numpy.arange(len(dates)) + rng.normal(0, 0.5, len(dates))
+
+    full_coef = draw_plot_bodymass(dates, measurements, io.BytesIO(), "Bodyweight, kg")
+    file_path = _get_file_path(_get_funcname())
+    downsampled_coef = draw_plot_bodymass(dates, measurements, file_path, "Bodyweight, kg", max_points=300)
+    # The trend line is still fitted to every record
+    assert numpy.allclose(downsampled_coef, full_coef)
+    print('Result saved to', file_path)
+
+
+def test_renderer_reuse():
+    print(f"Running {_get_funcname()}...", )
+
+    dates = [datetime(2021, 5, day) for day in range(1, 10)]
+    measurements = [100.5, 100.2, 101.1, 98.8, 98.6, 99.5, 99.1, 98.9, 98.2]
+    challenge = Challenge(user_id='1', is_active=1, start_date='2021/05/01', end_date='2021/06/01',
+                          start_weight=100, target_weight=95)
+
+    renderer = BodymassRenderer()
+    first = io.BytesIO()
+    renderer.draw(dates, measurements, first, "Bodyweight, kg")
+    # Whatever was drawn in between, nothing of it is left on the next plot
+    renderer.draw(dates[:3], [60, 61, 59], io.BytesIO(), "Вес, кг", challenge=challenge,
+                  date_limits=(datetime(2021, 4, 1), datetime(2021, 7, 1)))
+    renderer.draw([], [], io.BytesIO(), "Bodyweight, kg", challenge=challenge)
+    again = io.BytesIO()
+    renderer.draw(dates, measurements, again, "Bodyweight, kg")
+    assert again.getvalue() == first.getvalue()
+
+    fresh = io.BytesIO()
+    BodymassRenderer().draw(dates, measurements, fresh, "Bodyweight, kg")
+    assert fresh.getvalue() == first.getvalue()
+
+
+def test_render_profiles():
+    print(f"Running {_get_funcname()}...", )
+
+    dates = numpy.arange('2021-05-01', '2021-08-01', dtype='datetime64[D]')
+    measurements = 100 - 0.05 * numpy.arange(len(dates)) + numpy.random.default_rng(0).normal(0, 0.4, len(dates))
+
+    print(f"{'profile':<14} {'size px':>10} {'encode ms':>10} {'bytes':>8}")
+    for name, profile in render_profiles.items():
+        renderer = BodymassRenderer(profile)
+        image = io.BytesIO()
+        renderer.draw(dates, measurements, image, "Bodyweight, kg")
+        # Encode time: rasterizing the drawn plot and compressing it
+        started = time.perf_counter()
+        renderer.encode(io.BytesIO())
+        encode_ms = (time.perf_counter() - started) * 1000
+
+        with Image.open(image) as decoded:
+            assert decoded.format == profile.image_format.upper()
+            assert decoded.size == (round(profile.figsize[0] * profile.dpi), round(profile.figsize[1] * profile.dpi))
+            size = f"{decoded.width}x{decoded.height}"
+        print(f"{name:<14} {size:>10} {encode_ms:>10.0f} {len(image.getvalue()):>8}")
+
+
+def test_pillow_renderer_matches_matplotlib():
+    print(f"Running {_get_funcname()}...", )
+
+    today = datetime(2023, 3, 8)
+    dates = [today - timedelta(days=day) for day in range(20) if day % 3 != 1]
+    measurements = [85 + 0.08 * i + math.sin(i) * 0.4 for i in range(len(dates))]
+    challenge = Challenge(user_id='1', is_active=1, start_date='2023/02/25', end_date='2023/04/01',
+                          start_weight=86.5, target_weight=80)
+    past_challenge = Challenge(user_id='1', is_active=1, start_date='2022/02/25', end_date='2022/04/01',
+                               start_weight=96.5, target_weight=90)
+    cases = {
+        'plain': (dates, measurements, None),
+        'challenge': (dates, measurements, challenge),
+        'past_challenge': (dates, measurements, past_challenge),
+        'heavy': (dates, [mass + 60 for mass in measurements], challenge),
+        'one_point': (dates[:1], measurements[:1], None),
+        'no_points': ([], [], None),
+        'no_points_with_challenge': ([], [], challenge),
+    }
+    for name, (case_dates, case_measurements, case_challenge) in cases.items():
+        images = []
+        coefs = []
+        for draw in (draw_plot_bodymass, draw_plot_bodymass_pillow):
+            image = io.BytesIO()
+            coefs.append(draw(case_dates, case_measurements, image, "Bodyweight, kg", case_challenge,
+                              date_limits=(today - timedelta(days=14), today)))
+            images.append(Image.open(image).convert('L'))
+        assert images[0].size == images[1].size
+
+        # Same trend line: none without at least two points
+        if len(case_dates) < 2:
+            assert coefs == [None, None], name
+        else:
+            assert numpy.allclose(coefs[0], coefs[1]), name
+
+        # Same picture up to antialiasing and a pixel here and there: compared at 1/8 of the size
+        expected, actual = (numpy.asarray(image.reduce(8), dtype=numpy.float64) for image in images)
+        mean_difference = numpy.abs(expected - actual).mean()
+        assert mean_difference < 8, f"{name}: mean difference {mean_difference:.1f} / 255"
+
+        side_by_side = Image.new('L', (images[0].width, images[0].height * 2))
+        side_by_side.paste(images[0], (0, 0))
+        side_by_side.paste(images[1], (0, images[0].height))
+        side_by_side.save(_get_file_path(f"{_get_funcname()}_{name}"))
+
+
+def test_pillow_renderer_does_not_import_matplotlib():
+    print(f"Running {_get_funcname()}...", )
+
+    code = ("import io, sys\n"
+            "from datetime import datetime\n"
+            "from src.datautils.pillow_plotting import draw_plot_bodymass_pillow\n"
+            "draw_plot_bodymass_pillow([datetime(2023, 3, 1), datetime(2023, 3, 2)], [80, 79.5], io.BytesIO(), 'kg')\n"
+            "assert 'matplotlib' not in sys.modules\n")
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
 def main():
     for name, obj in inspect.getmembers(sys.modules[__name__]):
         if inspect.isfunction(obj) and name.startswith('test_'):
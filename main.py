@@ -1,6 +1,8 @@
 import asyncio
+import contextlib
 import logging.handlers
 import os
+import signal
 import sys
 import typing as t
 from datetime import datetime
@@ -8,15 +10,23 @@ from datetime import datetime
 from telebot import logger
 from telebot import types
 from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
 
 import src.config
-from src.datautils import date_format, update_database_schema
+from src.datautils import date_format, sqlite_db_path
 from src.datautils.bodymass import add_bodymass_record_now, delete_user_bodymass_data, \
     plot_user_bodymass_data, user_bodymass_data_to_csv, \
-    CSVParsingError, user_bodymass_data_from_csv_url, add_bodymass_record
+    CSVParsingError, user_bodymass_data_from_csv_url, add_bodymass_record, CSVFileTooBigError, csv_filename_template, \
+    plot_cache, BodymassPlot, sparkline_user_bodymass_data, BodymassSparkline
 from src.datautils.challenge import get_challenge, insert_challenge, get_challenge_not_none, Challenge, \
     delete_challenges, get_active_challenge, get_desired_speed_per_week
-from src.datautils.conversation import get_conversation_data, write_conversation_data, ConversationState, Language
+from src.datautils.conversation import get_conversation_data, write_conversation_data, ConversationState, Language, \
+    ConversationData, start_conversation_cache, stop_conversation_cache
+from src.datautils.dates import parse_date, format_date
+from src.datautils.estimators import set_default_estimator
+from src.datautils.migrations import migrate_database
+from src.datautils.pool import open_pool, close_pool, storage_profiles
+from src.datautils.render import start_render_pool, stop_render_pool, render_profiles, render_pool_saturated
 from src.glossaries import Glossary
 
 bot = AsyncTeleBot(src.config.TELEGRAM_TOKEN)
@@ -31,20 +41,19 @@ if debug_mode:
 else:
     logger.setLevel(logging.INFO)
 
-if os.environ.get("UPDATE_DATABASE"):
-    logger.info("UPDATE_DATABASE is defined. Updating database schema.")
-    update_database_schema()
-
-os.makedirs('logs', exist_ok=True)
-fh = logging.handlers.TimedRotatingFileHandler('logs/log', when='midnight', encoding='utf-8')
-fh.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s'))
-logger.addHandler(fh)
-
 
 def glossary(user_data: dict) -> Glossary:
     return Glossary(user_data.get('language'))
 
 
+async def challenge_draft(message: types.Message, user_data: dict) -> Challenge:
+    """The challenge being set up by the user, kept in the conversation data until it is finalized."""
+    if user_data.get('challenge_draft') is None:
+        # Drafts started before they were kept in the conversation data live in the challenges table
+        user_data['challenge_draft'] = await get_challenge_not_none(message.chat.id)
+    return user_data['challenge_draft']
+
+
 @bot.message_handler(content_types=['document'])
 @bot.message_handler(func=lambda _: True)
 async def handler(message):
@@ -71,7 +80,7 @@ def default_markup(user_data: dict):
     return reply_markup([glossary(user_data).enter_weight_button(), glossary(user_data).show_menu_button()])
 
 
-async def reply(message: types.Message, user_data: dict):
+async def reply(message: types.Message, user_data: ConversationData):
     logger.debug("User data:" + str(user_data))
 
     conversation_state = user_data['conversation_state']
@@ -92,6 +101,8 @@ async def reply(message: types.Message, user_data: dict):
             await reply_plot(message, user_data)
         elif message_text == '/plot_all':
             await reply_plot_all(message, user_data)
+        elif message_text == '/text_only':
+            await reply_text_only(message, user_data)
         elif message_text == '/download':
             await reply_download(message, user_data)
         elif message_text == '/upload':
@@ -185,11 +196,10 @@ async def reply_challenge(message: types.Message, user_data: dict):
         logger.error(f"Unexpected existing challenge info: {challenge}. Asking user to create a new one.")
         return await _reply_ask_new_challenge(message, user_data)
 
-    img_path, speed_week_kg, mean_mass = await plot_user_bodymass_data(message.chat.id,
-                                                                       only_two_weeks=False,
-                                                                       only_challenge_range=True,
-                                                                       plot_label=glossary(
-                                                                        user_data).bodyweight_plot_label())
+    plot = await plot_user_bodymass_data(message.chat.id,
+                                         only_two_weeks=False,
+                                         only_challenge_range=True,
+                                         plot_label=glossary(user_data).bodyweight_plot_label())
 
     logger.debug(f'Challenge: {challenge}')
 
@@ -200,20 +210,10 @@ async def reply_challenge(message: types.Message, user_data: dict):
         start_weight=challenge.start_weight,
         start_date=challenge.start_date,
         desired_speed=desired_speed,
-        current_speed=speed_week_kg or 0.0
+        current_speed=plot.speed_kg_week or 0.0
     )
 
-    with open(img_path, 'rb') as img_file_object:
-        await bot.send_photo(message.chat.id, caption=text,
-                             photo=img_file_object,
-                             reply_markup=default_markup(user_data),
-                             reply_to_message_id=message.id,
-                             parse_mode='HTML')
-
-    try:
-        os.remove(img_path)
-    except OSError:
-        pass
+    await send_plot(message, plot, text, user_data)
 
     user_data['conversation_state'] = ConversationState.init
 
@@ -242,6 +242,51 @@ async def reply_enter_weight(message: types.Message, user_data: dict):
     user_data['conversation_state'] = ConversationState.awaiting_body_weight
 
 
+async def send_plot(message: types.Message, plot: BodymassPlot, caption: str, user_data: dict):
+    """Reply with a plot. A plot that has already been uploaded is re-sent by its Telegram file id."""
+    send_photo_kwargs = dict(caption=caption,
+                             reply_markup=default_markup(user_data),
+                             reply_to_message_id=message.id,
+                             parse_mode='HTML')
+    if plot.file_id is not None:
+        try:
+            await bot.send_photo(message.chat.id, photo=plot.file_id, **send_photo_kwargs)
+            return
+        except ApiTelegramException as exception:
+            logger.warning("Telegram rejected cached photo %s, uploading it again: %s", plot.file_id, exception)
+            plot.file_id = None
+
+    sent_message = await bot.send_photo(message.chat.id, photo=plot.image, **send_photo_kwargs)
+    plot.file_id = sent_message.photo[-1].file_id
+
+
+async def send_text_plot(message: types.Message, text: str, user_data: dict):
+    """Reply with the caption a plot would have, and no photo."""
+    await bot.send_message(message.chat.id, text,
+                           reply_markup=default_markup(user_data),
+                           reply_to_message_id=message.id,
+                           parse_mode='HTML')
+
+
+def wants_text_plot(user_data: dict) -> bool:
+    """Text-only users get a sparkline instead of a plot, so does everybody while the render workers are busy."""
+    if user_data.get('text_only'):
+        return True
+    if render_pool_saturated():
+        logger.info("Render pool saturated, replying with a sparkline instead of a plot")
+        return True
+    return False
+
+
+def text_sparkline(summary: BodymassSparkline, user_data: dict) -> str:
+    if not summary.sparkline:
+        return f"{glossary(user_data).no_data_yet()}\n"
+    return glossary(user_data).sparkline_template().format(sparkline=summary.sparkline,
+                                                           min_mass=summary.min_mass,
+                                                           max_mass=summary.max_mass,
+                                                           mean_mass=summary.mean_mass)
+
+
 def text_deficit_maintenance_surplus(speed_week_kg: t.Optional[float], mean_mass: float, user_data: dict) -> str:
     text = ""
     if speed_week_kg is not None:
@@ -273,26 +318,24 @@ async def reply_body_weight(message: types.Message, user_data: dict):
         return
 
     await add_bodymass_record_now(message.chat.id, body_weight)
-    img_path, speed_week_kg, mean_mass = await plot_user_bodymass_data(message.chat.id,
-                                                                       only_two_weeks=True,
-                                                                       only_challenge_range=True,
-                                                                       plot_label=glossary(
-                                                                           user_data).bodyweight_plot_label())
-    with open(img_path, 'rb') as img_file_object:
-        text = f"{glossary(user_data).successfully_added_new_entry()}\n" \
-               f"<b>{datetime.now().strftime(date_format)} - {body_weight} kg</b>\n"
-        text += text_deficit_maintenance_surplus(speed_week_kg, mean_mass, user_data)
-
-        await bot.send_photo(message.chat.id, caption=text,
-                             photo=img_file_object,
-                             reply_markup=default_markup(user_data),
-                             reply_to_message_id=message.id,
-                             parse_mode='HTML')
+    text = f"{glossary(user_data).successfully_added_new_entry()}\n" \
+           f"<b>{format_date(datetime.now())} - {body_weight} kg</b>\n"
+
+    if wants_text_plot(user_data):
+        summary = await sparkline_user_bodymass_data(message.chat.id,
+                                                     only_two_weeks=True,
+                                                     only_challenge_range=True)
+        text += text_sparkline(summary, user_data)
+        text += text_deficit_maintenance_surplus(summary.trend.speed_kg_week, summary.trend.mean_mass, user_data)
+        await send_text_plot(message, text, user_data)
+    else:
+        plot = await plot_user_bodymass_data(message.chat.id,
+                                             only_two_weeks=True,
+                                             only_challenge_range=True,
+                                             plot_label=glossary(user_data).bodyweight_plot_label())
+        text += text_deficit_maintenance_surplus(plot.speed_kg_week, plot.mean_mass, user_data)
+        await send_plot(message, plot, text, user_data)
 
-    try:
-        os.remove(img_path)
-    except OSError:
-        pass
     user_data['conversation_state'] = ConversationState.init
 
 
@@ -309,7 +352,7 @@ def validate_body_weight(message: types.Message):
 def validate_date(message: types.Message) -> str:
     text = message.text.strip()
     if text.lower() in Glossary.todays_lowercase():
-        return datetime.now().strftime(date_format)
+        return format_date(datetime.now())
     try:
         text = text.replace('\\', '/')  # replace backslash with slash for user-friendliness
         datetime.strptime(text, date_format)
@@ -320,69 +363,63 @@ def validate_date(message: types.Message) -> str:
 
 
 async def reply_plot(message: types.Message, user_data: dict):
-    img_path, speed_week_kg, mean_mass = await plot_user_bodymass_data(message.chat.id,
-                                                                       only_two_weeks=True,
-                                                                       plot_label=glossary(
-                                                                           user_data).bodyweight_plot_label())
-    with open(img_path, 'rb') as img_file_object:
-        text = glossary(user_data).here_plot_last_two_weeks()
-        text += text_deficit_maintenance_surplus(speed_week_kg, mean_mass, user_data)
-
-        await bot.send_photo(message.chat.id, caption=text,
-                             photo=img_file_object,
-                             reply_markup=default_markup(user_data),
-                             reply_to_message_id=message.id,
-                             parse_mode='HTML')
-    try:
-        os.remove(img_path)
-    except OSError:
-        pass
+    if wants_text_plot(user_data):
+        summary = await sparkline_user_bodymass_data(message.chat.id, only_two_weeks=True)
+        text = glossary(user_data).here_sparkline_last_two_weeks()
+        text += text_sparkline(summary, user_data)
+        text += text_deficit_maintenance_surplus(summary.trend.speed_kg_week, summary.trend.mean_mass, user_data)
+        await send_text_plot(message, text, user_data)
+        user_data['conversation_state'] = ConversationState.init
+        return
+
+    plot = await plot_user_bodymass_data(message.chat.id,
+                                         only_two_weeks=True,
+                                         plot_label=glossary(user_data).bodyweight_plot_label())
+    text = glossary(user_data).here_plot_last_two_weeks()
+    text += text_deficit_maintenance_surplus(plot.speed_kg_week, plot.mean_mass, user_data)
+
+    await send_plot(message, plot, text, user_data)
     user_data['conversation_state'] = ConversationState.init
 
 
 async def reply_plot_all(message: types.Message, user_data: dict):
-    img_path, speed_week_kg, mean_mass = await plot_user_bodymass_data(message.chat.id,
-                                                                       only_two_weeks=False,
-                                                                       only_challenge_range=False,
-                                                                       plot_label=glossary(
-                                                                           user_data).bodyweight_plot_label())
-    with open(img_path, 'rb') as img_file_object:
-        text = glossary(user_data).here_plot_overall_progress()
-        text += text_deficit_maintenance_surplus(speed_week_kg, mean_mass, user_data)
-
-        await bot.send_photo(message.chat.id, caption=text,
-                             photo=img_file_object,
-                             reply_markup=default_markup(user_data),
-                             reply_to_message_id=message.id,
-                             parse_mode='HTML')
-    try:
-        os.remove(img_path)
-    except OSError:
-        pass
+    plot = await plot_user_bodymass_data(message.chat.id,
+                                         only_two_weeks=False,
+                                         only_challenge_range=False,
+                                         plot_label=glossary(user_data).bodyweight_plot_label())
+    text = glossary(user_data).here_plot_overall_progress()
+    text += text_deficit_maintenance_surplus(plot.speed_kg_week, plot.mean_mass, user_data)
 
+    await send_plot(message, plot, text, user_data)
+
+    user_data['conversation_state'] = ConversationState.init
+
+
+async def reply_text_only(message: types.Message, user_data: dict):
+    user_data['text_only'] = not user_data.get('text_only')
+    if user_data['text_only']:
+        text = glossary(user_data).text_only_enabled()
+    else:
+        text = glossary(user_data).text_only_disabled()
+    await bot.reply_to(message, text, reply_markup=default_markup(user_data))
     user_data['conversation_state'] = ConversationState.init
 
 
 async def reply_download(message: types.Message, user_data: dict):
-    csv_file_path = await user_bodymass_data_to_csv(message.chat.id)
-    file_size = os.path.getsize(csv_file_path)
-    if file_size == 0:
+    csv_file = await user_bodymass_data_to_csv(message.chat.id)
+    if not csv_file:
         text = glossary(user_data).no_data_to_download_yet()
         await bot.reply_to(message, text, reply_markup=default_markup(user_data))
     else:
         text = glossary(user_data).here_all_your_data()
         text += glossary(user_data).you_can_analyze_or_backup()
-        with open(csv_file_path, 'rb') as csv_file_object:
-            await bot.send_document(chat_id=message.chat.id,
-                                    reply_to_message_id=message.id,
-                                    reply_markup=default_markup(user_data),
-                                    document=csv_file_object,
-                                    parse_mode='HTML',
-                                    caption=text)
-    try:
-        os.remove(csv_file_path)
-    except OSError:
-        pass
+        await bot.send_document(chat_id=message.chat.id,
+                                reply_to_message_id=message.id,
+                                reply_markup=default_markup(user_data),
+                                document=csv_file,
+                                visible_file_name=csv_filename_template.format(user_id=message.chat.id),
+                                parse_mode='HTML',
+                                caption=text)
 
     user_data['conversation_state'] = ConversationState.init
 
@@ -409,10 +446,15 @@ async def reply_csv_table(message: types.Message, user_data: dict):
     file_url = 'https://api.telegram.org/file/bot{0}/{1}'.format(src.config.TELEGRAM_TOKEN, file_info.file_path)
 
     try:
-        await user_bodymass_data_from_csv_url(message.chat.id, file_url, src.config.MAX_BODY_WEIGHT)
-    except CSVParsingError:
+        report = await user_bodymass_data_from_csv_url(message.chat.id, file_url, src.config.MAX_BODY_WEIGHT,
+                                                        src.config.MAX_FILE_SIZE, src.config.CSV_DOWNLOAD_TIMEOUT)
+    except CSVParsingError as exception:
+        logger.info("Rejected CSV file from %s: %s", message.chat.id, exception)
         await bot.reply_to(message, glossary(user_data).file_invalid())
         return
+    except CSVFileTooBigError:
+        await bot.reply_to(message, glossary(user_data).file_too_big())
+        return
     except Exception as exception:
         await bot.reply_to(message, glossary(user_data).file_unexpected_error())
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -423,23 +465,14 @@ async def reply_csv_table(message: types.Message, user_data: dict):
 
         return
 
-    img_path, speed_week_kg, mean_mass = await plot_user_bodymass_data(message.chat.id,
-                                                                       only_two_weeks=False,
-                                                                       plot_label=glossary(
-                                                                           user_data).bodyweight_plot_label())
-    with open(img_path, 'rb') as img_file_object:
-        text = glossary(user_data).data_uploaded_successfully()
-        await bot.send_photo(message.chat.id, caption=text,
-                             photo=img_file_object,
-                             reply_markup=default_markup(user_data),
-                             reply_to_message_id=message.id,
-                             parse_mode='HTML')
+    logger.info("Imported CSV file from %s: %s", message.chat.id, report)
+    plot = await plot_user_bodymass_data(message.chat.id,
+                                         only_two_weeks=False,
+                                         plot_label=glossary(user_data).bodyweight_plot_label())
+    text = glossary(user_data).data_uploaded_successfully()
+    await send_plot(message, plot, text, user_data)
 
     user_data['conversation_state'] = ConversationState.init
-    try:
-        os.remove(img_path)
-    except OSError:
-        pass
 
 
 async def reply_erase(message: types.Message, user_data: dict):
@@ -455,12 +488,11 @@ async def reply_erase_confirmation(message, user_data: dict):
         user_data['conversation_state'] = ConversationState.init
         return
 
-    csv_file_path = await user_bodymass_data_to_csv(message.chat.id)
+    csv_file = await user_bodymass_data_to_csv(message.chat.id)
     await delete_user_bodymass_data(message.chat.id)
     await delete_challenges(message.chat.id)
 
-    file_size = os.path.getsize(csv_file_path)
-    if file_size == 0:
+    if not csv_file:
         text = glossary(user_data).no_data_yet()
         await bot.reply_to(message, text, reply_markup=default_markup(user_data))
         user_data['conversation_state'] = ConversationState.init
@@ -468,16 +500,12 @@ async def reply_erase_confirmation(message, user_data: dict):
 
     text = glossary(user_data).erase_complete()
 
-    with open(csv_file_path, 'rb') as csv_file_object:
-        await bot.send_document(chat_id=message.chat.id,
-                                reply_to_message_id=message.id,
-                                reply_markup=default_markup(user_data),
-                                document=csv_file_object,
-                                caption=text)
-    try:
-        os.remove(csv_file_path)
-    except OSError:
-        pass
+    await bot.send_document(chat_id=message.chat.id,
+                            reply_to_message_id=message.id,
+                            reply_markup=default_markup(user_data),
+                            document=csv_file,
+                            visible_file_name=csv_filename_template.format(user_id=message.chat.id),
+                            caption=text)
     user_data['conversation_state'] = ConversationState.init
 
 
@@ -540,9 +568,8 @@ async def reply_start_challenge_confirm(message: types.Message, user_data: dict)
         user_data['conversation_state'] = ConversationState.init
         return
 
-    challenge = Challenge(user_id=str(message.chat.id))
-    challenge.is_active = 0
-    await insert_challenge(challenge)
+    # The current challenge stays as it is until the new one is confirmed
+    user_data['challenge_draft'] = Challenge(user_id=str(message.chat.id))
 
     answer = glossary(user_data).enter_starting_weight()
     await bot.reply_to(message, answer)
@@ -556,11 +583,8 @@ async def reply_starting_weight(message: types.Message, user_data: dict):
         await bot.reply_to(message, glossary(user_data).please_enter_valid_positive_number())
         return
 
-    challenge = await get_challenge_not_none(message.chat.id)
+    challenge = await challenge_draft(message, user_data)
     challenge.start_weight = body_weight
-    challenge.is_active = 0
-
-    await insert_challenge(challenge)
 
     answer = glossary(user_data).enter_starting_date()
     today = glossary(user_data).today_lowercase().capitalize()
@@ -575,12 +599,9 @@ async def reply_starting_date(message: types.Message, user_data: dict):
         await bot.reply_to(message, glossary(user_data).please_enter_valid_date())
         return
 
-    challenge = await get_challenge_not_none(message.chat.id)
+    challenge = await challenge_draft(message, user_data)
     assert challenge.start_weight, "start_weight expected to be specified at this point of interaction with user"
     challenge.start_date = start_date
-    challenge.is_active = 0
-
-    await insert_challenge(challenge)
 
     answer = glossary(user_data).enter_target_weight()
     await bot.reply_to(message, answer)
@@ -594,7 +615,7 @@ async def reply_target_weight(message: types.Message, user_data: dict):
         await bot.reply_to(message, glossary(user_data).please_enter_valid_positive_number())
         return
 
-    challenge = await get_challenge_not_none(message.chat.id)
+    challenge = await challenge_draft(message, user_data)
     assert challenge.start_weight, "start_weight expected to be specified at this point of interaction with user"
     assert challenge.start_date, "start_date expected to be specified at this point of interaction with user"
 
@@ -603,9 +624,7 @@ async def reply_target_weight(message: types.Message, user_data: dict):
     #     return
 
     challenge.target_weight = target_weight
-    challenge.is_active = 0
 
-    await insert_challenge(challenge)
     answer = glossary(user_data).when_do_you_want_to_reach_template().format(target_weight=challenge.target_weight)
     await bot.reply_to(message, answer, parse_mode="HTML")
     user_data['conversation_state'] = ConversationState.awaiting_target_date
@@ -618,20 +637,17 @@ async def reply_target_date(message: types.Message, user_data: dict):
         await bot.reply_to(message, glossary(user_data).please_enter_valid_date())
         return
 
-    challenge = await get_challenge_not_none(message.chat.id)
+    challenge = await challenge_draft(message, user_data)
     assert challenge.start_weight, "start_weight expected to be specified at this point of interaction with user"
     assert challenge.start_date, "start_date expected to be specified at this point of interaction with user"
     assert challenge.target_weight, "target_weight expected to be specified at this point of interaction with user"
 
-    if datetime.strptime(challenge.start_date, date_format) > datetime.strptime(target_date, date_format):
+    if parse_date(challenge.start_date) > parse_date(target_date):
         text = glossary(user_data).target_date_cannot_be_earlier_template().format(start_date=challenge.start_date)
         await bot.reply_to(message, text)
         return
 
     challenge.end_date = target_date
-    challenge.is_active = 0
-
-    await insert_challenge(challenge)
 
     answer = glossary(user_data).please_confirm() + '\n\n'
     if challenge.start_weight < challenge.target_weight:
@@ -647,9 +663,7 @@ async def reply_target_date(message: types.Message, user_data: dict):
     answer += glossary(user_data).you_start_and_finish_template().format(start_date=challenge.start_date,
                                                                          target_date=challenge.end_date) + '\n'
 
-    start_datetime = datetime.strptime(challenge.start_date, date_format)
-    end_datetime = datetime.strptime(challenge.end_date, date_format)
-    delta = end_datetime - start_datetime
+    delta = parse_date(challenge.end_date) - parse_date(challenge.start_date)
     answer += glossary(user_data).your_challenge_will_last_template().format(days=delta.days) + '\n'
     answer += glossary(user_data).your_desired_speed_is_template().format(speed=get_desired_speed_per_week(challenge))
 
@@ -661,10 +675,11 @@ async def reply_challenge_finalize_confirmation(message: types.Message, user_dat
     text = message.text.strip()
     if text.lower() not in  Glossary.confirmation_words():
         await bot.reply_to(message, glossary(user_data).action_cancelled())
+        user_data['challenge_draft'] = None
         user_data['conversation_state'] = ConversationState.init
         return
 
-    challenge = await get_challenge_not_none(message.chat.id)
+    challenge = await challenge_draft(message, user_data)
     assert challenge.start_weight, 'all challenge fields expected to be specified'
     assert challenge.start_date, 'all challenge fields expected to be specified'
     assert challenge.target_weight, 'all challenge fields expected to be specified'
@@ -672,12 +687,62 @@ async def reply_challenge_finalize_confirmation(message: types.Message, user_dat
     challenge.is_active = 1
 
     await insert_challenge(challenge)
+    user_data['challenge_draft'] = None
     await add_bodymass_record(challenge.user_id,
-                              datetime.strptime(challenge.start_date, date_format),
+                              parse_date(challenge.start_date),
                               challenge.start_weight)
     answer = glossary(user_data).challenge_successfully_created()
     await bot.reply_to(message, answer)
     user_data['conversation_state'] = ConversationState.init
 
 
-asyncio.run(bot.polling(non_stop=True))
+def setup_log_file():
+    os.makedirs('logs', exist_ok=True)
+    fh = logging.handlers.TimedRotatingFileHandler('logs/log', when='midnight', encoding='utf-8')
+    fh.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s'))
+    logger.addHandler(fh)
+
+
+async def start_services(db_path: str = sqlite_db_path):
+    """Everything the bot needs before it polls. Neither NumPy nor matplotlib is loaded: the first plot loads them."""
+    logger.info("Database schema version %d -> %d", *migrate_database(db_path))
+    await open_pool(db_path, readers=src.config.SQLITE_READERS,
+                    profile=storage_profiles[src.config.SQLITE_STORAGE_PROFILE])
+    start_conversation_cache(src.config.CONVERSATION_CACHE_SIZE, src.config.CONVERSATION_FLUSH_INTERVAL_MS)
+    set_default_estimator(src.config.TREND_ESTIMATOR)
+    start_render_pool(src.config.RENDER_WORKERS, src.config.PLOT_MAX_POINTS,
+                      render_profiles[src.config.RENDER_PROFILE], src.config.TWO_WEEK_RENDERER,
+                      src.config.RENDER_MAX_QUEUE_DEPTH)
+    plot_cache.resize(src.config.PLOT_CACHE_SIZE, src.config.PLOT_CACHE_MAX_BYTES)
+
+
+async def stop_services():
+    logger.info("Plot cache stats: %s, hit ratio %.2f", plot_cache.stats, plot_cache.stats.hit_ratio)
+    logger.info("Render pool stats: %s", stop_render_pool())
+    logger.info("Conversation cache stats: %s", await stop_conversation_cache())
+    logger.info("Connection pool stats: %s", await close_pool())
+
+
+async def main():
+    await start_services()
+    polling = asyncio.create_task(bot.polling(non_stop=True))
+
+    def stop_polling(signal_number: int):
+        logger.info("Received %s, stopping", signal.Signals(signal_number).name)
+        polling.cancel()
+
+    # docker stop sends SIGTERM: stop polling, so that stop_services() flushes pending conversation data
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signal_number, stop_polling, signal_number)
+    try:
+        with contextlib.suppress(asyncio.CancelledError):
+            await polling
+    finally:
+        await stop_services()
+
+
+# Render workers are spawned processes that import this module: only the bot process runs the bot
+if __name__ == "__main__":
+    setup_log_file()
+    asyncio.run(main())
@@ -0,0 +1,226 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+from datetime import datetime
+
+import numpy
+
+from db_tests import run_with_pool
+from src.datautils.bodymass import add_bodymass_record, plot_user_bodymass_data, PlotCache, plot_cache, \
+    delete_user_bodymass_data, BodymassPlot
+from src.datautils.challenge import Challenge, insert_challenge
+from src.datautils.render import RenderJob, RenderPool, start_render_pool, stop_render_pool, render_plot, \
+    render_pool_saturated
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+DATES = [
+    datetime(2021, 5, 1),
+    datetime(2021, 5, 3),
+    datetime(2021, 5, 4),
+    datetime(2021, 5, 6),
+    datetime(2021, 5, 7),
+    datetime(2021, 5, 9)
+]
+MEASUREMENTS = [
+    100.5,
+    100.2,
+    101.1,
+    98.8,
+    98.6,
+    99.5
+]
+
+
+def test_render_pool():
+    async def scenario():
+        pool = RenderPool(workers=1)
+        pool.start()
+        try:
+            job = RenderJob(DATES, MEASUREMENTS, "Bodyweight, kg")
+            results = await asyncio.gather(pool.render(job), pool.render(job))
+        finally:
+            pool.shutdown()
+        return results, pool.stats
+
+    results, stats = asyncio.run(scenario())
+    for image, regression_coef in results:
+        assert image.startswith(PNG_SIGNATURE)
+        assert numpy.allclose(regression_coef, [-2.26190476e-01, 4.34130714e+03])
+
+    assert stats.submitted == 2
+    assert stats.completed == 2
+    assert stats.queue_depth == 0
+    assert stats.render_seconds_max > 0
+    print(stats)
+
+
+def test_render_pool_restarts_after_worker_died():
+    async def scenario():
+        pool = RenderPool(workers=1)
+        pool.start()
+        try:
+            job = RenderJob(DATES, MEASUREMENTS, "Bodyweight, kg")
+            await pool.render(job)
+            # As the OOM killer would
+            for process in pool._executor._processes.values():
+                os.kill(process.pid, signal.SIGKILL)
+            image, _ = await pool.render(job)
+            await pool.render(job)
+        finally:
+            pool.shutdown()
+        return image, pool.stats
+
+    image, stats = asyncio.run(scenario())
+    assert image.startswith(PNG_SIGNATURE)
+    assert stats.restarts == 1
+    assert stats.completed == 3 and stats.failed == 0
+
+
+def test_render_pool_saturated():
+    async def scenario():
+        assert not render_pool_saturated()
+        start_render_pool(workers=1, max_queue_depth=2)
+        try:
+            job = RenderJob(DATES, MEASUREMENTS, "Bodyweight, kg")
+            first = asyncio.create_task(render_plot(job))
+            await asyncio.sleep(0)
+            saturated_with_one = render_pool_saturated()
+            second = asyncio.create_task(render_plot(job))
+            await asyncio.sleep(0)
+            saturated_with_two = render_pool_saturated()
+            await asyncio.gather(first, second)
+            return saturated_with_one, saturated_with_two, render_pool_saturated()
+        finally:
+            stop_render_pool()
+
+    assert asyncio.run(scenario()) == (False, True, False)
+
+
+def test_plot_user_bodymass_data_in_memory():
+    async def scenario():
+        for date, mass in zip(DATES, MEASUREMENTS):
+            await add_bodymass_record(1, date, mass)
+        return await plot_user_bodymass_data(1)
+
+    plot = run_with_pool(scenario)
+    assert plot.image.startswith(PNG_SIGNATURE)
+    assert plot.speed_kg_week == -1.58
+    assert numpy.isclose(plot.mean_mass, numpy.mean(MEASUREMENTS))
+
+
+def test_plot_cache_bounds():
+    cache = PlotCache(max_entries=2, max_bytes=10)
+    cache.put('a', BodymassPlot(b'1234', None, 0.0))
+    cache.put('b', BodymassPlot(b'1234', None, 0.0))
+    assert cache.get('a') is not None
+    cache.put('c', BodymassPlot(b'1234', None, 0.0))
+    assert cache.get('b') is None
+    assert len(cache) == 2
+
+    cache.put('d', BodymassPlot(b'12345678', None, 0.0))
+    assert len(cache) == 1
+    assert cache.size_bytes == 8
+    assert cache.stats.evictions == 3
+    assert cache.stats.hit_ratio == 0.5
+
+
+def test_plot_user_bodymass_data_cached():
+    user_id = 1001
+
+    async def scenario():
+        for date, mass in zip(DATES, MEASUREMENTS):
+            await add_bodymass_record(user_id, date, mass)
+
+        hits = plot_cache.stats.hits
+        first = await plot_user_bodymass_data(user_id)
+        first.file_id = 'uploaded'
+        assert (await plot_user_bodymass_data(user_id)).file_id == 'uploaded'
+        assert plot_cache.stats.hits == hits + 1
+        assert await plot_user_bodymass_data(user_id, plot_label='Вес, кг') is not first
+
+        await insert_challenge(Challenge(user_id=str(user_id), is_active=1, start_date='2021/05/01',
+                                         end_date='2021/06/01', start_weight=100, target_weight=95))
+        with_challenge = await plot_user_bodymass_data(user_id)
+        assert with_challenge is not first
+
+        await add_bodymass_record(user_id, datetime(2021, 5, 10), 99.0)
+        assert await plot_user_bodymass_data(user_id) is not with_challenge
+
+        await delete_user_bodymass_data(user_id)
+        return await plot_user_bodymass_data(user_id, ignore_challenge=True)
+
+    plot = run_with_pool(scenario)
+    assert plot.image.startswith(PNG_SIGNATURE)
+    assert plot.speed_kg_week is None
+    assert plot.file_id is None
+
+
+def test_bot_starts_without_numpy():
+    code = ("import asyncio, sys, tempfile\n"
+            "import main\n"
+            "async def boot(db_path):\n"
+            "    await main.start_services(db_path)\n"
+            "    await main.stop_services()\n"
+            "with tempfile.TemporaryDirectory() as tmp_dir:\n"
+            "    asyncio.run(boot(tmp_dir + '/test.sqlite'))\n"
+            "assert 'numpy.core' not in sys.modules and 'matplotlib' not in sys.modules\n")
+    subprocess.run([sys.executable, '-c', code], env=dict(os.environ, TELEGRAM_TOKEN='0:test'), check=True)
+
+
+def test_sigterm_flushes_conversation_data():
+    code = ("import asyncio, os, signal, sqlite3, sys, tempfile\n"
+            "import main, src.config\n"
+            "from src.datautils.conversation import get_conversation_data, write_conversation_data\n"
+            "src.config.CONVERSATION_FLUSH_INTERVAL_MS = 60 * 1000\n"
+            "async def polling(**kwargs):\n"
+            "    user_data = await get_conversation_data(1)\n"
+            "    user_data['conversation_state'] = 'awaiting_body_weight'\n"
+            "    await write_conversation_data(1, user_data)\n"
+            "    os.kill(os.getpid(), signal.SIGTERM)\n"
+            "    await asyncio.sleep(60)\n"
+            "main.bot.polling = polling\n"
+            "with tempfile.TemporaryDirectory() as tmp_dir:\n"
+            "    start_services = main.start_services\n"
+            "    main.start_services = lambda: start_services(tmp_dir + '/test.sqlite')\n"
+            "    asyncio.run(main.main())\n"
+            "    with sqlite3.connect(tmp_dir + '/test.sqlite') as db:\n"
+            "        rows = db.execute('SELECT user_id, conversation_state FROM users_context').fetchall()\n"
+            "    db.close()\n"
+            "assert rows == [('1', 'awaiting_body_weight')], rows\n")
+    subprocess.run([sys.executable, '-c', code], env=dict(os.environ, TELEGRAM_TOKEN='0:test'), check=True,
+                   timeout=30)
+
+def test_send_plot_uploads_again_when_file_id_rejected():
+    code = ("import asyncio, types\n"
+            "import main\n"
+            "from telebot.asyncio_helper import ApiTelegramException\n"
+            "from src.datautils.bodymass import BodymassPlot\n"
+            "sent = []\n"
+            "async def send_photo(chat_id, photo, **kwargs):\n"
+            "    sent.append(photo)\n"
+            "    if photo == 'expired':\n"
+            "        raise ApiTelegramException('sendPhoto', None,\n"
+            "                                   {'error_code': 400, 'description': 'wrong file identifier'})\n"
+            "    return types.SimpleNamespace(photo=[types.SimpleNamespace(file_id='uploaded')])\n"
+            "main.bot.send_photo = send_photo\n"
+            "plot = BodymassPlot(b'png', None, 80.0, file_id='expired')\n"
+            "message = types.SimpleNamespace(id=2, chat=types.SimpleNamespace(id=1))\n"
+            "asyncio.run(main.send_plot(message, plot, 'caption', {}))\n"
+            "assert sent == ['expired', b'png'], sent\n"
+            "assert plot.file_id == 'uploaded', plot.file_id\n")
+    subprocess.run([sys.executable, '-c', code], env=dict(os.environ, TELEGRAM_TOKEN='0:test'), check=True)
+
+
+if __name__ == "__main__":
+    test_render_pool()
+    test_render_pool_restarts_after_worker_died()
+    test_render_pool_saturated()
+    test_plot_user_bodymass_data_in_memory()
+    test_plot_cache_bounds()
+    test_plot_user_bodymass_data_cached()
+    test_bot_starts_without_numpy()
+    test_sigterm_flushes_conversation_data()
+    test_send_plot_uploads_again_when_file_id_rejected()
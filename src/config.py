@@ -2,8 +2,26 @@ import os
 
 from telebot import asyncio_helper
 
-SQLITE_PATH = 'data/bodymass.db'
+SQLITE_READERS = 2
+# One of src.datautils.pool.storage_profiles
+SQLITE_STORAGE_PROFILE = 'fast'
+# One of src.datautils.estimators.trend_estimators
+TREND_ESTIMATOR = 'least_squares'
+CONVERSATION_CACHE_SIZE = 10000
+CONVERSATION_FLUSH_INTERVAL_MS = 1000
+RENDER_WORKERS = 1
+PLOT_CACHE_SIZE = 256
+PLOT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+# Longer series are downsampled for drawing, trends are still computed on every record
+PLOT_MAX_POINTS = 1000
+# One of src.datautils.render.render_profiles
+RENDER_PROFILE = 'telegram'
+# 'matplotlib' or 'pillow': the two-week plot sent after every record is simple enough to draw without matplotlib
+TWO_WEEK_RENDERER = 'pillow'
+# Plots in flight from which /plot and new records are answered with a text sparkline instead, None to always draw
+RENDER_MAX_QUEUE_DEPTH = 8
 MAX_FILE_SIZE = 100 * 1024
+CSV_DOWNLOAD_TIMEOUT = 30
 MAX_BODY_WEIGHT = 1000
 MAINTENANCE_THRESHOLD = 0.001
 
@@ -1,24 +1,44 @@
 import dataclasses
-import os
-import sqlite3
+import importlib.util
+import sys
+import types
 
 sqlite_db_path = 'data/bodymass.sqlite'
-sql_header_path = 'data/bodymass.sql'
 
+date_format = "%Y/%m/%d"
 
-def update_database_schema():
-    with sqlite3.connect(sqlite_db_path) as db_:
-        with open(sql_header_path, 'r') as sql_header:
-            for command in sql_header.read().split(';'):
-                db_.execute(command)
+# Per-user revision of everything a plot is drawn from (body mass records and challenges).
+# Bumped after every change, so that derived data cached in this process can be keyed on it.
+_data_revisions: dict[int, int] = {}
 
 
-if not os.path.exists(sqlite_db_path):
-    update_database_schema()
+def data_revision(user_id: int | str) -> int:
+    return _data_revisions.get(int(user_id), 0)
 
-date_format = "%Y/%m/%d"
+
+def bump_data_revision(user_id: int | str) -> None:
+    user_id = int(user_id)
+    _data_revisions[user_id] = _data_revisions.get(user_id, 0) + 1
 
 
 def dataclass_field_names(cls: type):
     assert hasattr(cls, '__dataclass_fields__')
     return [field.name for field in dataclasses.fields(cls)]
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Import a module on first attribute access rather than now.
+
+    NumPy takes a tenth of a second and 20 MB to import: the bot has to be polling before that, and an idle bot
+    should not pay for it at all. Modules that use it lazily keep it out of their import-time code, annotations
+    included (`from __future__ import annotations`).
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
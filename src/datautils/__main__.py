@@ -0,0 +1,9 @@
+"""Create or migrate a database: python -m src.datautils [path/to/bodymass.sqlite]"""
+import sys
+
+from src.datautils import sqlite_db_path
+from src.datautils.migrations import migrate_database
+
+path = sys.argv[1] if len(sys.argv) > 1 else sqlite_db_path
+old_version, new_version = migrate_database(path)
+print(f"{path}: schema version {old_version} -> {new_version}")
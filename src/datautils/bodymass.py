@@ -1,67 +1,169 @@
+from __future__ import annotations
+
 import csv
-import os
+import dataclasses
+import io
 import typing as t
-import uuid
-from codecs import iterdecode
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import datetime, timedelta, date as date_type
 
+import aiohttp
 import aiosqlite
-import numpy as np
-import requests
-from matplotlib import pyplot
-from matplotlib.dates import date2num, DateFormatter
 
-from src.datautils import sqlite_db_path, date_format
+from src.datautils import date_format, data_revision, bump_data_revision, queries, lazy_import
 from src.datautils.challenge import Challenge, get_active_challenge
+from src.datautils.dates import parse_date, format_date, parse_date_column, format_date_column, date_to_day, \
+    days_to_date_column, date_column_to_days, date_limits_to_days
+from src.datautils.estimators import default_estimator
+from src.datautils.pool import get_pool
+from src.datautils.render import RenderJob, render_plot, two_week_renderer
+from src.datautils.sparkline import sparkline
+from src.datautils.trend import RegressionSums, Trend, fetch_user_trend
+
+np = lazy_import('numpy')
 
-sqlite_db_users_mass = 'users_mass'
-csv_tmp_folder = 'data/tmp/'
-csv_tmp_filename_template = 'bodymass_{user_id}_{hash}.csv'
-csv_uploaded_tmp_filename_template = 'uploaded_{user_id}_{hash}.csv'
-plot_tmp_folder = 'data/tmp/'
-plot_tmp_filename_template = '{user_id}_{hash}.png'
+csv_filename_template = 'bodymass_{user_id}.csv'
 
 
 async def add_bodymass_record_now(user_id: int, body_mass: float) -> None:
     await add_bodymass_record(user_id, datetime.now().date(), body_mass)
 
 
-async def add_bodymass_record(user_id: int, date: datetime.date, body_mass: float) -> None:
-    async with aiosqlite.connect(sqlite_db_path) as db:
-        query = f"INSERT INTO {sqlite_db_users_mass} (user_id, date, body_mass) " \
-                f"VALUES ('{user_id}', '{date.strftime(date_format)}', {body_mass}); "
+async def _add_regression_sums(db: aiosqlite.Connection, user_id: int,
+                               added: t.Iterable[tuple[int, float]],
+                               replaced: t.Iterable[tuple[int, float]] = ()) -> None:
+    """Update users_mass_stats for records written in the current transaction. Replaced rows are taken out."""
+    delta = RegressionSums().add(added).add(replaced, sign=-1)
+    await db.execute(queries.ADD_USER_STATS, (int(user_id), *dataclasses.astuple(delta)))
 
-        await db.execute(query)
+
+async def add_bodymass_record(user_id: int, date: datetime.date, body_mass: float) -> None:
+    row = date_to_day(date), float(body_mass)
+    async with get_pool().writer() as db:
+        async with db.execute(queries.SELECT_USER_BODYMASS_DAY, (int(user_id), row[0])) as cursor:
+            replaced = await cursor.fetchall()
+        await db.execute(queries.INSERT_BODYMASS, (int(user_id), *row))
+        await _add_regression_sums(db, user_id, [row], replaced)
         await db.commit()
+    bump_data_revision(user_id)
 
 
 async def delete_user_bodymass_data(user_id: int) -> None:
-    async with aiosqlite.connect(sqlite_db_path) as db:
-        await db.execute(f"DELETE FROM {sqlite_db_users_mass} WHERE user_id = '{user_id}'")
+    async with get_pool().writer() as db:
+        await db.execute(queries.DELETE_USER_BODYMASS, (int(user_id),))
+        await db.execute(queries.DELETE_USER_STATS, (int(user_id),))
         await db.commit()
+    bump_data_revision(user_id)
 
 
-async def fetch_user_bodymass_data(user_id: int):
-    async with aiosqlite.connect(sqlite_db_path) as db:
-        async with db.cursor() as cursor:
-            await cursor.execute(f"SELECT date, body_mass FROM {sqlite_db_users_mass} "
-                                 f"WHERE user_id = '{user_id}' ORDER BY date ASC")
-            while row := await cursor.fetchone():
-                yield row
+async def fetch_user_bodymass_series(user_id: int, date_limits: t.Optional[tuple[datetime, datetime]] = None) \
+        -> tuple[np.ndarray, np.ndarray]:
+    """Fetch user records ordered by date in one go, only the ones within date_limits if given.
+
+    :return: dates (datetime64[D]) and body masses (float64)
+    """
+    if date_limits is None:
+        query, parameters = queries.SELECT_USER_BODYMASS, (int(user_id),)
+    else:
+        query, parameters = queries.SELECT_USER_BODYMASS_RANGE, (int(user_id), *date_limits_to_days(date_limits))
+
+    async with get_pool().reader() as db:
+        async with db.execute(query, parameters) as cursor:
+            rows = await cursor.fetchall()
+
+    if not rows:
+        return days_to_date_column([]), np.array([], dtype=np.float64)
+
+    days, masses = zip(*rows)
+    return days_to_date_column(days), np.array(masses, dtype=np.float64)
+
+
+PlotKey = tuple[int, int, date_type, bool, bool, t.Optional[tuple], str, str]
+
+
+@dataclasses.dataclass
+class BodymassPlot:
+    image: bytes
+    speed_kg_week: t.Optional[float]
+    mean_mass: float
+    # Telegram file id of the image once it has been sent. Plots are shared through the plot cache,
+    # so setting it lets later requests for the same plot re-send it by id instead of uploading it again.
+    file_id: t.Optional[str] = None
+
+
+@dataclasses.dataclass
+class PlotCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
 
+class PlotCache:
+    """LRU cache of rendered plots, bounded both by the number of entries and by their total size.
+
+    Keys contain the user's data revision, so entries for outdated data are never hit again
+    and simply age out.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = PlotCacheStats()
+        self._entries: OrderedDict[PlotKey, BodymassPlot] = OrderedDict()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def resize(self, max_entries: int, max_bytes: int) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def get(self, key: PlotKey) -> t.Optional[BodymassPlot]:
+        plot = self._entries.get(key)
+        if plot is None:
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        self._entries.move_to_end(key)
+        return plot
+
+    def put(self, key: PlotKey, plot: BodymassPlot) -> None:
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key).image)
+        self._entries[key] = plot
+        self._size += len(plot.image)
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+            _, plot = self._entries.popitem(last=False)
+            self._size -= len(plot.image)
+            self.stats.evictions += 1
 
-def random_hash() -> str:
-    """Returns a random 8-piece hash"""
-    return uuid.uuid4().hex[:8]
+
+plot_cache = PlotCache()
 
 
 async def plot_user_bodymass_data(user_id: int, *,
                                   only_two_weeks: bool = False,
                                   only_challenge_range: bool = False,
                                   plot_label: str = 'Bodyweight, kg',
-                                  ignore_challenge: bool = False
+                                  ignore_challenge: bool = False,
+                                  estimator: t.Optional[str] = None
                                   ) \
-        -> tuple[str, t.Optional[np.array], float]:
+        -> BodymassPlot:
     """Plot user data to an image.
 
     Keyword arguments:
@@ -70,39 +172,67 @@ async def plot_user_bodymass_data(user_id: int, *,
     :param only_challenge_range: draw only challenge range
     :param plot_label: plot label
     :param ignore_challenge: if True, challenge will be ignored
+    :param estimator: trend line estimator, a key of trend_estimators; the deployment default if None
 
-    :return: image temporary file path, speed kg/week, mean body mass
+    :return: PNG image, speed kg/week and mean body mass; the same object is returned while it is cached
     """
-    os.makedirs(plot_tmp_folder, exist_ok=True)
-    plot_file_path = os.path.join(plot_tmp_folder,
-                                  plot_tmp_filename_template.format(user_id=user_id, hash=random_hash()))
+    estimator = estimator or default_estimator()
+    revision = data_revision(user_id)
+    challenge = None
+    if not ignore_challenge:
+        challenge = await get_active_challenge(user_id)
+
+    key = (int(user_id), revision, datetime.now().date(), only_two_weeks, only_challenge_range,
+           dataclasses.astuple(challenge) if challenge else None, plot_label, estimator)
+    if (plot := plot_cache.get(key)) is not None:
+        return plot
+
+    date_limits = _get_date_limits(challenge, only_challenge_range, only_two_weeks)
+    dates, masses = await fetch_user_bodymass_series(user_id, date_limits)
+    # The caption comes from the records, the renderer only draws them
+    trend = await fetch_user_trend(user_id, date_limits, estimator, (dates, masses))
+
+    image, _ = await render_plot(RenderJob(dates, masses, plot_label, challenge=challenge,
+                                           date_limits=date_limits, estimator=estimator,
+                                           renderer=two_week_renderer() if only_two_weeks else 'matplotlib'))
+
+    plot = BodymassPlot(image, trend.speed_kg_week, trend.mean_mass)
+    plot_cache.put(key, plot)
+    return plot
+
 
-    date_list: list[datetime] = []
-    mass_list: list[float] = []
-    async for (date_str, body_mass) in fetch_user_bodymass_data(user_id):
-        date_list.append(datetime.strptime(date_str, date_format))
-        mass_list.append(body_mass)
+@dataclasses.dataclass(frozen=True)
+class BodymassSparkline:
+    """Text stand-in for a BodymassPlot: the plotted records as a sparkline, their range and the same trend."""
+    sparkline: str
+    min_mass: float
+    max_mass: float
+    mean_mass: float
+    """of the records of the sparkline; the trend's mean is all-time, as in the plot captions"""
+    trend: Trend
 
+
+async def sparkline_user_bodymass_data(user_id: int, *,
+                                       only_two_weeks: bool = False,
+                                       only_challenge_range: bool = False,
+                                       ignore_challenge: bool = False,
+                                       estimator: t.Optional[str] = None) -> BodymassSparkline:
+    """Summarize the records plot_user_bodymass_data() would draw, without rendering anything.
+
+    Arguments are those of plot_user_bodymass_data(). Min, max and mean are nan if there are no records.
+    """
+    estimator = estimator or default_estimator()
     challenge = None
     if not ignore_challenge:
         challenge = await get_active_challenge(user_id)
 
-    regression_coef = draw_plot_bodymass(date_list,
-                                         mass_list,
-                                         plot_file_path,
-                                         plot_label,
-                                         challenge=challenge,
-                                         date_limits=_get_date_limits(
-                                             challenge,
-                                             only_challenge_range,
-                                             only_two_weeks)
-                                         )
+    date_limits = _get_date_limits(challenge, only_challenge_range, only_two_weeks)
+    dates, masses = await fetch_user_bodymass_series(user_id, date_limits)
+    trend = await fetch_user_trend(user_id, date_limits, estimator, (dates, masses))
 
-    speed_kg_week = round(regression_coef[0] * 7, 2) if regression_coef is not None else None
-    if len(mass_list) < 4:
-        speed_kg_week = None
-
-    return plot_file_path, speed_kg_week, float(np.mean(mass_list))
+    if len(masses) == 0:
+        return BodymassSparkline('', float('nan'), float('nan'), float('nan'), trend)
+    return BodymassSparkline(sparkline(dates, masses), masses.min(), masses.max(), masses.mean(), trend)
 
 
 def _get_date_limits(
@@ -111,150 +241,133 @@ def _get_date_limits(
         only_two_weeks: bool
 ) -> t.Optional[tuple[datetime, datetime]]:
     if only_challenge_range and challenge:
-        return (datetime.strptime(challenge.start_date, date_format),
-                datetime.strptime(challenge.end_date, date_format))
+        return parse_date(challenge.start_date), parse_date(challenge.end_date)
     if only_two_weeks:
         return datetime.now() - timedelta(days=14), datetime.now()
 
 
-def desired_regression(challenge: Challenge):
-    y = challenge.start_weight, challenge.target_weight
-    x = list(map(date2num, [datetime.strptime(challenge.start_date, date_format),
-                            datetime.strptime(challenge.end_date, date_format)]))
-    coef = np.polyfit(x, y, 1)
-    func = np.poly1d(coef)
-    return x, func(x)
-
-
-def filter_dates(date_filter: t.Callable[[datetime], bool],
-                 date: t.Iterable[datetime],
-                 mass: t.Iterable[float]) -> tuple[t.Iterable[datetime], t.Iterable[float]]:
-    filtered_date = []
-    filtered_mass = []
-
-    for date_elem, mass_elem in zip(date, mass):
-        if date_filter(date_elem):
-            filtered_date.append(date_elem)
-            filtered_mass.append(mass_elem)
-
-    return filtered_date, filtered_mass
-
-
-def draw_plot_bodymass(date: t.Iterable[datetime], mass: list[float], file_path: str, plot_label: str,
-                       challenge: Challenge | None = None,
-                       start_label: str = 'Start',
-                       target_label: str = 'Goal',
-                       date_limits: t.Optional[tuple[datetime, datetime]] = None) -> t.Optional[np.array]:
-    if date_limits:
-        def fits_limits(datetime_obj: datetime) -> bool:
-            return date_limits[0] <= datetime_obj <= date_limits[1]
+async def user_bodymass_data_to_csv(user_id: int) -> bytes:
+    """Export user data from the database as a csv table.
 
-        date, mass = filter_dates(fits_limits, date, mass)
-
-    x = list(map(date2num, date))
-    y = mass
-
-    fig, ax = pyplot.subplots(figsize=[8, 5])
-
-    if challenge:
-        _draw_challenge(challenge, start_label, target_label)
-
-    pyplot.xlim(*_get_x_limits(date_limits, x))
-    pyplot.ylim(*_get_y_limits(challenge, y))
-
-    pyplot.scatter(x, y)
-
-    regression_coef = None
-    if len(x) > 1:
-        regression_coef = np.polyfit(x, y, 1)
-        pyplot.plot(x, np.poly1d(regression_coef)(x))
+    Keyword arguments:
+    :param user_id: user id
 
-    pyplot.ylabel(plot_label)
+    :return csv file contents, empty if the user has no data
+    """
+    dates, masses = await fetch_user_bodymass_series(user_id)
 
-    ax.xaxis.set_major_formatter(DateFormatter('%d %b'))
-    pyplot.xticks(rotation=45)
-    pyplot.grid()
-    pyplot.tight_layout()
+    csv_file_object = io.StringIO(newline='')
+    csv_writer = csv.writer(csv_file_object)
+    csv_writer.writerows(zip(format_date_column(dates), masses.tolist()))
 
-    pyplot.savefig(file_path, dpi=300)
-    pyplot.close('all')
+    return csv_file_object.getvalue().encode('utf-8')
 
-    return regression_coef
 
+class CSVParsingError(Exception):
+    def __init__(self, line_number: int = 0, rejected: int = 0):
+        super().__init__(f"{rejected} invalid row(s), first at line {line_number}" if rejected else "invalid file")
+        self.line_number = line_number
+        self.rejected = rejected
 
-def _draw_challenge(challenge: Challenge, start_label: str, target_label: str):
-    desired_x, desired_y = desired_regression(challenge)
-    pyplot.plot(desired_x, desired_y, linestyle='dashed', color='red', markevery=[0, -1], marker='x')
 
-    def annotate(label: str, x_, y_):
-        pyplot.annotate(label, (x_, y_), color='red', ha='center', va='top',
-                        xytext=(0, -5), textcoords="offset points")
+class CSVFileTooBigError(Exception):
+    pass
 
-    annotate(f'{start_label}', desired_x[0], desired_y[0])
-    annotate(f'{target_label}', desired_x[1], desired_y[1])
 
+@dataclasses.dataclass
+class CSVImportReport:
+    inserted: int = 0
+    replaced: int = 0
 
-def _get_y_limits(challenge: t.Optional[Challenge], y: t.Sequence[float]) -> t.Sequence[float]:
-    """
-    :returns: arguments for pyplot.ylim()
-    """
-    if len(y) > 0:
-        return min(y) // 5 * 5 - 6, max(y) // 5 * 5 + 6
-    elif challenge is None:
-        return 64, 76
-    return []
 
+def parse_bodymass_csv(lines: t.Iterable[str], max_body_weight: int) -> dict[str, float]:
+    """Parse and validate a whole csv table before anything is written.
 
-def _get_x_limits(date_limits: t.Optional[tuple[datetime, datetime]], x: t.Sequence[float]) -> t.Sequence[float]:
-    """
-    :returns: arguments for pyplot.xlim()
+    :return: body mass by date string (date_format); a later row for the same date wins
+    :raises: CSVParsingError if any row is invalid
     """
-    if not date_limits:
-        return []
-
-    min_x = date2num(date_limits[0])
-    max_x = date2num(date_limits[1])
-    if len(x) > 0:
-        min_x = max(min_x, min(x)) - 1
-        max_x = min(max_x, max(x)) + 1
+    records: dict[str, float] = {}
+    rejected = 0
+    first_rejected_line = 0
+    for line_number, row in enumerate(csv.reader(lines), start=1):
+        try:
+            date, body_weight = row
+            date = datetime.strptime(date, date_format)
+            body_weight = float(body_weight)
+            assert 0 < body_weight < max_body_weight
+        except Exception:
+            rejected += 1
+            first_rejected_line = first_rejected_line or line_number
+            continue
+
+        records[format_date(date)] = body_weight
+
+    if rejected:
+        raise CSVParsingError(first_rejected_line, rejected)
+
+    return records
+
+
+async def import_bodymass_records(user_id: int, records: dict[str, float]) -> CSVImportReport:
+    """Upsert all records in a single transaction."""
+    report = CSVImportReport()
+    if not records:
+        return report
+
+    days = date_column_to_days(parse_date_column(list(records))).tolist()
+    async with get_pool().writer() as db:
+        async with db.cursor() as cursor:
+            await cursor.execute(queries.SELECT_USER_BODYMASS_DAYS_RANGE, (int(user_id), min(days), max(days)))
+            existing = dict(await cursor.fetchall())
 
-    return min_x, max_x
+        rows = list(zip(days, map(float, records.values())))
+        replaced = [(day, existing[day]) for day in days if day in existing]
+        await db.executemany(queries.INSERT_BODYMASS, [(int(user_id), *row) for row in rows])
+        await _add_regression_sums(db, user_id, rows, replaced)
+        await db.commit()
+    bump_data_revision(user_id)
 
+    report.replaced = len(replaced)
+    report.inserted = len(records) - report.replaced
+    return report
 
-async def user_bodymass_data_to_csv(user_id: int) -> str:
-    """Save user data from the database to a csv file.
 
-    Keyword arguments:
-    :param user_id: user id
+async def download_csv_lines(csv_url: str, max_file_size: int, timeout: float) -> list[str]:
+    """Download a text file without blocking the event loop.
 
-    :return csv temporary file path
+    :return: decoded lines without line terminators
+    :raises: CSVFileTooBigError as soon as more than max_file_size bytes are received
+    :raises: asyncio.TimeoutError, aiohttp.ClientError
     """
+    lines: list[str] = []
+    received = 0
+    tail = b''
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout), trust_env=True) as session:
+        async with session.get(csv_url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(8192):
+                received += len(chunk)
+                if received > max_file_size:
+                    raise CSVFileTooBigError(f"more than {max_file_size} bytes")
+
+                *complete_lines, tail = (tail + chunk).split(b'\n')
+                lines.extend(line.decode('utf-8').rstrip('\r') for line in complete_lines)
+
+    if tail:
+        lines.append(tail.decode('utf-8').rstrip('\r'))
+    return lines
+
+
+async def user_bodymass_data_from_csv_url(user_id: int, csv_url: str, max_body_weight: int,
+                                          max_file_size: int, timeout: float = 30) -> CSVImportReport:
+    """Import a csv table of body weight records. Nothing is imported if any row is invalid.
+
+    :raises: CSVParsingError, CSVFileTooBigError, asyncio.TimeoutError, aiohttp.ClientError
+    """
+    try:
+        lines = await download_csv_lines(csv_url, max_file_size, timeout)
+    except UnicodeDecodeError:
+        raise CSVParsingError()
 
-    os.makedirs(csv_tmp_folder, exist_ok=True)
-    csv_file_path = os.path.join(csv_tmp_folder,
-                                 csv_tmp_filename_template.format(user_id=user_id, hash=random_hash()))
-    with open(csv_file_path, 'w', newline='', encoding='utf-8') as csv_file_object:
-        csv_writer = csv.writer(csv_file_object)
-        async for row in fetch_user_bodymass_data(user_id):
-            csv_writer.writerow(row)
-
-    return csv_file_path
-
-
-class CSVParsingError(Exception):
-    pass
-
-
-async def user_bodymass_data_from_csv_url(user_id: int, csv_url: str, max_body_weight: int) -> None:
-    with requests.get(csv_url) as request:
-        csv_reader = csv.reader(iterdecode(request.iter_lines(), 'utf-8'))
-        for row in csv_reader:
-            try:
-                date, body_weight = row
-                date = datetime.strptime(date, date_format)
-                body_weight = float(body_weight)
-                assert 0 < body_weight < max_body_weight
-            except Exception:
-                raise CSVParsingError()
-
-            await add_bodymass_record(user_id, date, body_weight)
+    records = parse_bodymass_csv(lines, max_body_weight)
+    return await import_bodymass_records(user_id, records)
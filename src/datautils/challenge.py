@@ -1,13 +1,9 @@
 import dataclasses
 import typing as t
-from datetime import datetime
-from decimal import Decimal
 
-import aiosqlite
-
-from src.datautils import date_format, sqlite_db_path
-
-sqlite_db_users_challenges = 'users_challenges'
+from src.datautils import bump_data_revision, queries
+from src.datautils.dates import parse_date
+from src.datautils.pool import get_pool
 
 
 @dataclasses.dataclass
@@ -21,21 +17,10 @@ class Challenge:
     start_weight: float = 0
     target_weight: float = 0
 
-    def date_filter(self) -> t.Callable[[datetime], bool]:
-        def func(datetime_object: datetime) -> bool:
-            return datetime.strptime(self.start_date, date_format) <= datetime_object <= datetime.strptime(
-                self.end_date, date_format)
-
-        return func
-
-    @classmethod
-    def represent_column_for_sql(cls, value, column: str):
-        if column in ['user_id', 'start_date', 'end_date']:
-            return f"'{value}'"
-        if column in ['is_active']:
-            return f"{int(value)}"
-        if column in ['start_weight', 'target_weight']:
-            return f"{float(value)}"
+    def to_row(self) -> tuple:
+        """Parameters of queries.INSERT_CHALLENGE"""
+        return (str(self.user_id), int(self.is_active), self.start_date, self.end_date,
+                float(self.start_weight), float(self.target_weight))
 
 
 def get_desired_speed_per_week(challenge: Challenge) -> float:
@@ -43,7 +28,7 @@ def get_desired_speed_per_week(challenge: Challenge) -> float:
     :raises: ZeroDivisionError in case challenge.end_date == challenge.start_date
     :raises: ValueError if challenge dates are invalid
     """
-    delta = datetime.strptime(challenge.end_date, date_format) - datetime.strptime(challenge.start_date, date_format)
+    delta = parse_date(challenge.end_date) - parse_date(challenge.start_date)
     delta_weeks = delta.total_seconds() / (60*60*24*7)
     delta_kg = challenge.target_weight - challenge.start_weight
 
@@ -51,12 +36,9 @@ def get_desired_speed_per_week(challenge: Challenge) -> float:
 
 
 async def get_challenges(user_id: int) -> list[Challenge]:
-    async with aiosqlite.connect(sqlite_db_path) as db:
+    async with get_pool().reader() as db:
         async with db.cursor() as cursor:
-            query = f"SELECT user_id, is_active, start_date, end_date, start_weight, target_weight " \
-                    f"FROM {sqlite_db_users_challenges} " \
-                    f"WHERE user_id = '{user_id}';"
-            await cursor.execute(query)
+            await cursor.execute(queries.SELECT_USER_CHALLENGES, (str(user_id),))
             challenges = [Challenge(*challenge) for challenge in await cursor.fetchall()]
 
             return challenges
@@ -74,9 +56,10 @@ async def get_challenge(user_id: int) -> t.Optional[Challenge]:
 
 
 async def delete_challenges(user_id: int):
-    async with aiosqlite.connect(sqlite_db_path) as db:
-        await db.execute(f"DELETE FROM {sqlite_db_users_challenges} WHERE user_id = '{user_id}'")
+    async with get_pool().writer() as db:
+        await db.execute(queries.DELETE_USER_CHALLENGES, (str(user_id),))
         await db.commit()
+    bump_data_revision(user_id)
 
 
 async def get_active_challenge(user_id: int) -> t.Optional[Challenge]:
@@ -88,16 +71,10 @@ async def get_active_challenge(user_id: int) -> t.Optional[Challenge]:
 
 
 async def insert_challenge(challenge: Challenge) -> None:
-    columns = 'user_id', 'is_active', 'start_date', 'end_date', 'start_weight', 'target_weight'
-    async with aiosqlite.connect(sqlite_db_path) as db:
-        columns_joined: str = ', '.join(columns)
-        values_for_sql = [Challenge.represent_column_for_sql(getattr(challenge, col), col) for col in columns]
-        values_joined: str = ', '.join(values_for_sql)
-        query = f"INSERT INTO {sqlite_db_users_challenges} ({columns_joined}) " \
-                f"VALUES ({values_joined}); "
-
-        await db.execute(query)
+    async with get_pool().writer() as db:
+        await db.execute(queries.INSERT_CHALLENGE, challenge.to_row())
         await db.commit()
+    bump_data_revision(challenge.user_id)
 
 
 async def get_challenge_not_none(user_id: int):
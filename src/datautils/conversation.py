@@ -1,10 +1,15 @@
-import sqlite3
+import asyncio
+import dataclasses
+import json
+import typing as t
+from collections import OrderedDict
 
 import aiosqlite
+from telebot import logger
 
-sqlite_db_path = 'data/bodymass.sqlite'
-sqlite_db_users_conversation = 'users_conversation'
-sqlite_db_users_language = 'users_language'
+from src.datautils import queries
+from src.datautils.challenge import Challenge
+from src.datautils.pool import get_pool
 
 
 def _assert_enum_consistency(cls: type):
@@ -45,67 +50,244 @@ _assert_enum_consistency(Language)
 languages = [k for k in vars(Language).keys() if not k.startswith('_')]
 
 
+class ConversationData(dict):
+    """Per-user context: conversation state, language, the in-progress challenge draft and whether plots are sent
+    as text only.
 
-async def get_conversation_data(user_id: int) -> dict:
-    async with aiosqlite.connect(sqlite_db_path) as db:
-        result = dict()
-        result['conversation_state'] = await get_conversation_state(db, user_id)
-        result['language'] = await get_language(db, user_id) or DEFAULT_LANGUAGE
+    Remembers the row it was loaded from, so that an unchanged context is not written back.
+    """
 
-        return result
+    def __init__(self, conversation_state: str = ConversationState.init, language: str = DEFAULT_LANGUAGE,
+                 challenge_draft: t.Optional[Challenge] = None, text_only: bool = False):
+        super().__init__(conversation_state=conversation_state,
+                         language=language,
+                         challenge_draft=challenge_draft,
+                         text_only=text_only)
+        self.mark_clean()
 
+    @classmethod
+    def from_row(cls, row: t.Optional[tuple]) -> 'ConversationData':
+        if row is None:
+            return cls()
 
-async def get_conversation_state(db: aiosqlite.Connection, user_id: int) -> str:
-    async with db.cursor() as cursor:
-        query = f"SELECT conversation_state FROM {sqlite_db_users_conversation} " \
-                f"WHERE user_id = '{user_id}';"
-        await cursor.execute(query)
-        conversation_state = await cursor.fetchone()
-        conversation_state = conversation_state[0] if conversation_state is not None else 'init'
+        conversation_state, language, challenge_draft, text_only = row
         assert conversation_state in conversation_states
+        assert language is None or language in languages
+        if challenge_draft is not None:
+            challenge_draft = Challenge(**json.loads(challenge_draft))
+
+        return cls(conversation_state, language or DEFAULT_LANGUAGE, challenge_draft, bool(text_only))
+
+    def to_row(self) -> tuple[str, str, t.Optional[str], int]:
+        challenge_draft = self.get('challenge_draft')
+        if challenge_draft is not None:
+            challenge_draft = json.dumps(dataclasses.asdict(challenge_draft))
+        return (self['conversation_state'], self.get('language') or DEFAULT_LANGUAGE, challenge_draft,
+                int(bool(self.get('text_only'))))
+
+    def copy(self) -> 'ConversationData':
+        """An independent copy, challenge draft included, that is dirty where this one is."""
+        other = ConversationData.from_row(self.to_row())
+        other.mark_clean(self._clean_row)
+        return other
+
+    @property
+    def is_dirty(self) -> bool:
+        return self.to_row() != self._clean_row
+
+    def mark_clean(self, row: t.Optional[tuple] = None) -> None:
+        """Remember `row` (the current contents by default) as the one stored in the database."""
+        self._clean_row = row if row is not None else self.to_row()
+
+
+@dataclasses.dataclass
+class ConversationCacheStats:
+    hits: int = 0
+    misses: int = 0
+    flushes: int = 0
+    rows_flushed: int = 0
+
+
+class ConversationCache:
+    """Write-behind LRU cache of conversation data keyed by user id.
+
+    Changed entries are only marked dirty; a background task writes all of them in one transaction
+    every `flush_interval_ms`. Dirty entries are never evicted, so the cache may temporarily
+    exceed `max_size` until the next flush.
+
+    Entries are only replaced by update() and mark_dirty(): get_conversation_data() hands out copies, so that a
+    handler that fails halfway leaves nothing behind and concurrent updates of a chat do not share an object.
+    """
 
-        return conversation_state
+    def __init__(self, max_size: int = 10000, flush_interval_ms: int = 1000):
+        assert max_size > 0
+        self.max_size = max_size
+        self.flush_interval_ms = flush_interval_ms
+        self.stats = ConversationCacheStats()
 
+        self._entries: OrderedDict[int, ConversationData] = OrderedDict()
+        self._dirty: set[int] = set()
+        self._flush_task: t.Optional[asyncio.Task] = None
 
-async def get_language(db: aiosqlite.Connection, user_id: int) -> str | None:
-    try:
-        async with db.cursor() as cursor:
-            query = f"SELECT language FROM {sqlite_db_users_language} " \
-                    f"WHERE user_id = '{user_id}';"
-            await cursor.execute(query)
-            language = await cursor.fetchone()
-            if language is not None:
-                language = language[0]
-                assert language in languages
+    def __len__(self) -> int:
+        return len(self._entries)
 
-            return language
-    except sqlite3.OperationalError as exc:
-        if str(exc) == f'no such table: {sqlite_db_users_language}':
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    def get(self, user_id: int) -> t.Optional[ConversationData]:
+        user_data = self._entries.get(user_id)
+        if user_data is None:
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        self._entries.move_to_end(user_id)
+        return user_data
+
+    def put(self, user_id: int, user_data: ConversationData) -> ConversationData:
+        """Add freshly loaded data. If another coroutine has cached the user meanwhile, its data wins."""
+        if user_id in self._entries:
+            return self._entries[user_id]
+
+        self._entries[user_id] = user_data
+        self._evict()
+        return user_data
+
+    def update(self, user_id: int, user_data: ConversationData) -> None:
+        """Replace the cached entry unless it already holds the same row.
+
+        Compares with the cached entry rather than with the row `user_data` was loaded from: a copy handed out before
+        a change that is not flushed yet would otherwise look clean when set back to its original value.
+        An evicted entry was flushed, but `user_data` may be older than that flush, so it is always written.
+        """
+        cached = self._entries.get(user_id)
+        if cached is not None and cached.to_row() == user_data.to_row():
             return
-        raise exc
+        self.mark_dirty(user_id, user_data)
 
+    def mark_dirty(self, user_id: int, user_data: ConversationData) -> None:
+        self._entries[user_id] = user_data
+        self._entries.move_to_end(user_id)
+        self._dirty.add(user_id)
 
-async def write_conversation_data(user_id: int, user_data: dict) -> None:
-    async with aiosqlite.connect(sqlite_db_path) as db:
-        await write_conversation_state(db, user_data['conversation_state'], user_id)
-        if 'language' in user_data:
-            await write_language(db, user_data['language'], user_id)
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
 
+        pending = [(user_id, self._entries[user_id]) for user_id in self._dirty]
+        self._dirty.clear()
+        rows = [(user_id, user_data.to_row()) for user_id, user_data in pending]
+        try:
+            async with get_pool().writer() as db:
+                await write_context_rows(db, rows)
+                await db.commit()
+        except BaseException:
+            self._dirty.update(user_id for user_id, _ in pending)
+            raise
 
-async def write_conversation_state(db: aiosqlite.Connection, conversation_state: str, user_id: int):
-    query = f"INSERT INTO {sqlite_db_users_conversation} (user_id, conversation_state) " \
-            f"VALUES ('{user_id}', '{conversation_state}'); "
-    await db.execute(query)
-    await db.commit()
+        for (_, user_data), (_, row) in zip(pending, rows):
+            user_data.mark_clean(row)
 
+        self.stats.flushes += 1
+        self.stats.rows_flushed += len(rows)
+        self._evict()
 
-async def write_language(db: aiosqlite.Connection, language: str, user_id: int):
-    try:
-        query = f"INSERT INTO {sqlite_db_users_language} (user_id, language) " \
-                f"VALUES ('{user_id}', '{language}'); "
-        await db.execute(query)
-        await db.commit()
-    except sqlite3.OperationalError as exc:
-        if str(exc) == f'no such table: {sqlite_db_users_language}':
+    def start(self) -> None:
+        assert self._flush_task is None, "flush task is already running"
+        self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        """Stop the background task and write out everything that is still pending."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_ms / 1000)
+            try:
+                await self.flush()
+            except Exception as exception:
+                logger.error("Failed to flush conversation data: %s: %s", type(exception).__name__, exception)
+
+    def _evict(self) -> None:
+        if len(self._entries) <= self.max_size:
             return
-        raise exc
+
+        for user_id in list(self._entries):
+            if len(self._entries) <= self.max_size:
+                break
+            if user_id not in self._dirty:
+                del self._entries[user_id]
+
+
+_cache: t.Optional[ConversationCache] = None
+
+
+def start_conversation_cache(max_size: int = 10000, flush_interval_ms: int = 1000) -> ConversationCache:
+    """Keep conversation data in memory and write it behind. Called once at bot startup, after open_pool()."""
+    global _cache
+    assert _cache is None, "conversation cache is already running"
+    _cache = ConversationCache(max_size, flush_interval_ms)
+    _cache.start()
+    return _cache
+
+
+async def stop_conversation_cache() -> t.Optional[ConversationCacheStats]:
+    """Flush pending conversation data and stop caching. Returns the cache counters."""
+    global _cache
+    if _cache is None:
+        return None
+    cache, _cache = _cache, None
+    await cache.stop()
+    return cache.stats
+
+
+async def get_conversation_data(user_id: int) -> ConversationData:
+    """The user's context, to be changed and passed to write_conversation_data(). Changes are not seen until then."""
+    if _cache is not None and (user_data := _cache.get(user_id)) is not None:
+        return user_data.copy()
+
+    async with get_pool().reader() as db:
+        user_data = ConversationData.from_row(await read_context_row(db, user_id))
+
+    if _cache is not None:
+        user_data = _cache.put(user_id, user_data).copy()
+    return user_data
+
+
+async def read_context_row(db: aiosqlite.Connection, user_id: int) -> t.Optional[tuple]:
+    async with db.cursor() as cursor:
+        await cursor.execute(queries.SELECT_USER_CONTEXT, (str(user_id),))
+        return await cursor.fetchone()
+
+
+async def write_conversation_data(user_id: int, user_data: ConversationData) -> None:
+    """Save the context if it has changed since loading.
+
+    With the conversation cache running the context replaces the cached one and is written at the next flush,
+    otherwise it is a single UPSERT.
+    """
+    if _cache is not None:
+        _cache.update(user_id, user_data)
+        return
+
+    if not user_data.is_dirty:
+        return
+
+    row = user_data.to_row()
+    async with get_pool().writer() as db:
+        await write_context_rows(db, [(user_id, row)])
+        await db.commit()
+    user_data.mark_clean(row)
+
+
+async def write_context_rows(db: aiosqlite.Connection, rows: list[tuple[int, tuple]]) -> None:
+    await db.executemany(queries.UPSERT_USER_CONTEXT, [(str(user_id), *row) for user_id, row in rows])
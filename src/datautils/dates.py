@@ -0,0 +1,73 @@
+"""Conversion between date strings (date_format), stored day numbers and datetime / NumPy values."""
+from __future__ import annotations
+
+import functools
+import typing as t
+from datetime import date, datetime, time, timedelta
+
+from src.datautils import date_format, lazy_import
+
+np = lazy_import('numpy')
+
+DATE_DTYPE = 'datetime64[D]'
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date(date_string: str) -> datetime:
+    """Parse a date string stored in the database. Memoized: challenge dates are parsed over and over.
+
+    :raises: ValueError if the string does not match date_format
+    """
+    return datetime.strptime(date_string, date_format)
+
+
+def format_date(datetime_object: datetime) -> str:
+    return datetime_object.strftime(date_format)
+
+
+def parse_date_column(date_strings: t.Sequence[str]) -> np.ndarray:
+    """Parse a whole column of stored date strings at once.
+
+    Only zero-padded dates are accepted, as written by format_date(); user input goes through parse_date().
+
+    :return: datetime64[D] array
+    :raises: ValueError if any string is not a valid date
+    """
+    if len(date_strings) == 0:
+        return np.array([], dtype=DATE_DTYPE)
+    # '2023/03/01' -> '2023-03-01', which NumPy parses natively
+    return np.char.replace(np.asarray(date_strings, dtype=str), '/', '-').astype(DATE_DTYPE)
+
+
+def format_date_column(dates: np.ndarray) -> list[str]:
+    """Inverse of parse_date_column()."""
+    return np.char.replace(np.datetime_as_string(dates.astype(DATE_DTYPE), unit='D'), '-', '/').tolist()
+
+
+# Body mass records are stored by day number: days since 1970-01-01, the epoch of datetime64 and date2num
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def date_to_day(date_object: date) -> int:
+    """Day number of a date (or of the date part of a datetime)."""
+    return date_object.toordinal() - _EPOCH_ORDINAL
+
+
+def day_to_date(day: int) -> date:
+    return date.fromordinal(day + _EPOCH_ORDINAL)
+
+
+def date_limits_to_days(date_limits: tuple[datetime, datetime]) -> tuple[int, int]:
+    """First and last day number of the records draw_plot_bodymass() keeps for these limits."""
+    start, end = date_limits
+    first_date = start.date() if start.time() == time() else start.date() + timedelta(days=1)
+    return date_to_day(first_date), date_to_day(end.date())
+
+
+def days_to_date_column(days: t.Sequence[int] | np.ndarray) -> np.ndarray:
+    """:return: datetime64[D] array of day numbers, no parsing involved"""
+    return np.asarray(days, dtype=np.int64).astype(DATE_DTYPE)
+
+
+def date_column_to_days(dates: np.ndarray) -> np.ndarray:
+    return dates.astype(DATE_DTYPE).astype(np.int64)
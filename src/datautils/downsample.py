@@ -0,0 +1,50 @@
+"""Fewer points for the scatter of long histories, keeping its shape.
+
+Years of daily records are thousands of points where the plot has room for a few hundred: they take long to draw
+and blow up the PNG without showing anything more.
+"""
+from __future__ import annotations
+
+from src.datautils import lazy_import
+
+np = lazy_import('numpy')
+
+DEFAULT_MAX_PLOT_POINTS = 1000
+
+
+def lttb(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: per bucket of points, the one making the largest triangle with the point kept
+    in the previous bucket and the mean of the next bucket.
+
+    The first and the last points are always kept, so are the lowest and the highest ones: they set the y limits.
+
+    :param x: ascending
+    :return: sorted indices of the kept points: at most max_points, plus the lowest and highest ones if LTTB
+             did not keep them; all of them if there are no more than max_points
+    """
+    n = len(x)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Buckets of the points between the first and the last one
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    # Mean of the next bucket, the last point for the last bucket
+    next_x = np.append(sums_x[1:] / counts[1:], x[-1])
+    next_y = np.append(sums_y[1:] / counts[1:], y[-1])
+
+    kept = np.empty(max_points, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket, (start, end) in enumerate(zip(edges[:-1], edges[1:])):
+        # Twice the triangle areas, vectorized over the bucket
+        areas = np.abs((x[previous] - next_x[bucket]) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y[bucket] - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+
+    return np.union1d(kept, [np.argmin(y), np.argmax(y)])
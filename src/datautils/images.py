@@ -0,0 +1,16 @@
+"""Encoding of rendered plots, shared by the matplotlib and the Pillow renderers."""
+import typing as t
+
+from PIL import Image
+
+from src.datautils.render import RenderProfile
+
+
+def encode_image(image: Image.Image, file: str | t.BinaryIO, profile: RenderProfile) -> None:
+    """Write an RGB image in the profile's format."""
+    if profile.image_format == 'jpeg':
+        image.save(file, format='JPEG', quality=profile.jpeg_quality)
+        return
+    if profile.palette_colors is not None:
+        image = image.quantize(profile.palette_colors, method=Image.Quantize.FASTOCTREE)
+    image.save(file, format='PNG', compress_level=profile.png_compress_level)
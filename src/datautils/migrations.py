@@ -0,0 +1,160 @@
+"""Versioned schema migrations.
+
+The schema version of a database is kept in `PRAGMA user_version`. A new database is created from bodymass.sql
+at the latest version, an existing one runs the migrations it has not seen yet. Either way in a single transaction,
+once at startup, or by hand:
+    python -m src.datautils [path/to/bodymass.sqlite]
+"""
+import sqlite3
+import typing as t
+
+from telebot import logger
+
+from src.datautils import sqlite_db_path
+
+schema_path = 'data/bodymass.sql'
+
+# Day numbers are days since 1970-01-01: julianday() counts from noon of 4714 BC, 24 November
+_UNIX_EPOCH_JULIAN_DAY = 2440587.5
+
+
+def _is_empty(db: sqlite3.Connection) -> bool:
+    return db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table'").fetchone() is None
+
+
+def _columns(db: sqlite3.Connection, table: str) -> list[str]:
+    return [row[1] for row in db.execute(f"PRAGMA table_info({table})")]
+
+
+# Databases created before versioning are at version 0 whatever their tables look like,
+# so every migration up to _users_mass_by_day checks whether its change is already there.
+
+def _baseline(db: sqlite3.Connection) -> None:
+    """Tables of the first releases."""
+    db.execute("CREATE TABLE IF NOT EXISTS users_challenges (user_id TEXT (32) PRIMARY KEY UNIQUE ON CONFLICT REPLACE, "
+               "is_active INTEGER NOT NULL, start_date DATE NOT NULL, end_date DATE NOT NULL, "
+               "start_weight REAL NOT NULL, target_weight REAL NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS users_conversation (user_id TEXT (32) UNIQUE ON CONFLICT REPLACE, "
+               "conversation_state TEXT)")
+    db.execute("CREATE TABLE IF NOT EXISTS users_language (user_id TEXT (32) PRIMARY KEY UNIQUE ON CONFLICT REPLACE, "
+               "language TEXT (32) NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS users_mass (record_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+               "user_id TEXT (32), date DATE NOT NULL, body_mass REAL, "
+               "CONSTRAINT user_date_constraint UNIQUE (user_id, date) ON CONFLICT REPLACE)")
+
+
+def _users_context(db: sqlite3.Connection) -> None:
+    """Conversation state and language in one row per user."""
+    db.execute("CREATE TABLE IF NOT EXISTS users_context (user_id TEXT (32) PRIMARY KEY, "
+               "conversation_state TEXT NOT NULL, language TEXT (32), challenge_draft TEXT)")
+    # Users may have a row in either table only: a language chosen before any conversation state was saved
+    db.execute("INSERT OR IGNORE INTO users_context (user_id, conversation_state, language) "
+               "SELECT users.user_id, COALESCE(users_conversation.conversation_state, 'init'), "
+               "       users_language.language "
+               "  FROM (SELECT user_id FROM users_conversation UNION SELECT user_id FROM users_language) AS users "
+               "       LEFT JOIN users_conversation ON users_conversation.user_id = users.user_id "
+               "       LEFT JOIN users_language ON users_language.user_id = users.user_id "
+               " WHERE users_conversation.conversation_state IS NOT NULL OR users_language.language IS NOT NULL")
+    db.execute("DROP TABLE users_conversation")
+    db.execute("DROP TABLE users_language")
+
+
+def _users_mass_by_day(db: sqlite3.Connection) -> bool:
+    """(record_id, TEXT user_id, 'YYYY/MM/DD' date) rows to a WITHOUT ROWID table keyed on (user_id, day).
+
+    :return: whether the table was rewritten, leaving the pages of the old one free
+    """
+    if 'record_id' not in _columns(db, 'users_mass'):
+        return False
+
+    db.execute("CREATE TABLE users_mass_by_day (user_id INTEGER NOT NULL, day INTEGER NOT NULL, "
+               "body_mass REAL NOT NULL, PRIMARY KEY (user_id, day) ON CONFLICT REPLACE) WITHOUT ROWID")
+    # Rows are copied in insertion order, so that the latest record of a day wins as before
+    db.execute(f"INSERT INTO users_mass_by_day (user_id, day, body_mass) "
+               f"SELECT CAST(user_id AS INTEGER), "
+               f"       CAST(julianday(replace(date, '/', '-')) - {_UNIX_EPOCH_JULIAN_DAY} AS INTEGER), "
+               f"       body_mass "
+               f"  FROM users_mass "
+               f" WHERE body_mass IS NOT NULL AND julianday(replace(date, '/', '-')) IS NOT NULL "
+               f" ORDER BY record_id")
+    (copied,), = db.execute("SELECT COUNT(*) FROM users_mass_by_day")
+    (total,), = db.execute("SELECT COUNT(*) FROM users_mass")
+    # The user_id index goes with the old table
+    db.execute("DROP TABLE users_mass")
+    db.execute("ALTER TABLE users_mass_by_day RENAME TO users_mass")
+    logger.info("users_mass converted to day numbers: %d rows copied, %d duplicate or invalid rows dropped",
+                copied, total - copied)
+    return True
+
+
+def _users_mass_stats(db: sqlite3.Connection) -> None:
+    """Per-user regression sums over users_mass."""
+    db.execute("CREATE TABLE users_mass_stats (user_id INTEGER PRIMARY KEY, n INTEGER NOT NULL, "
+               "sum_x INTEGER NOT NULL, sum_y REAL NOT NULL, sum_xy REAL NOT NULL, sum_xx INTEGER NOT NULL)")
+    db.execute("INSERT INTO users_mass_stats (user_id, n, sum_x, sum_y, sum_xy, sum_xx) "
+               "SELECT user_id, COUNT(*), SUM(day), SUM(body_mass), SUM(day * body_mass), SUM(day * day) "
+               "  FROM users_mass "
+               " GROUP BY user_id")
+
+
+def _users_context_text_only(db: sqlite3.Connection) -> None:
+    """Per-user text-only plot replies."""
+    db.execute("ALTER TABLE users_context ADD COLUMN text_only INTEGER NOT NULL DEFAULT 0")
+
+
+# Append only: a migration's position is the version it upgrades from.
+# A migration that returns True freed a whole table's pages: the database is vacuumed after the upgrade.
+MIGRATIONS: list[t.Callable[[sqlite3.Connection], t.Optional[bool]]] = [
+    _baseline,
+    _users_context,
+    _users_mass_by_day,
+    _users_mass_stats,
+    _users_context_text_only,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def _create_schema(db: sqlite3.Connection) -> None:
+    with open(schema_path, 'r') as schema:
+        for statement in schema.read().split(';'):
+            db.execute(statement)
+
+
+def migrate_database(db_path: str = sqlite_db_path) -> tuple[int, int]:
+    """Bring the database to SCHEMA_VERSION, creating it if needed.
+
+    :return: schema version before and after
+    :raises: RuntimeError if the database was written by a newer version of the bot
+    """
+    db = sqlite3.connect(db_path, isolation_level=None)
+    vacuum = False
+    try:
+        # IMMEDIATE: no other process can slip a write between reading the version and bumping it
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            (version,), = db.execute("PRAGMA user_version")
+            if version > SCHEMA_VERSION:
+                raise RuntimeError(f"database schema version {version} is newer than {SCHEMA_VERSION}")
+
+            if version == 0 and _is_empty(db):
+                _create_schema(db)
+            else:
+                for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                    logger.info("Migrating database schema to version %d: %s", number, migration.__doc__)
+                    vacuum |= bool(migration(db))
+
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+        if vacuum:
+            # Hands the freed pages back to the filesystem. Not possible inside a transaction, so it comes after
+            # the commit: if it fails, the database is already migrated, only bigger than it needs to be
+            logger.info("Vacuuming the database")
+            db.execute("VACUUM")
+    finally:
+        db.close()
+
+    return version, SCHEMA_VERSION
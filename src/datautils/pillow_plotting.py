@@ -0,0 +1,326 @@
+"""Body mass plots drawn with Pillow alone: no matplotlib import, no layout engine.
+
+Draws what the two-week plot needs, looking like the matplotlib one: axes, grid, ticks, date labels, records,
+trend line and the challenge line with its Start / Goal annotations. Ticks are placed as matplotlib places them
+on these axes (MaxNLocator on day numbers), sizes follow matplotlib's defaults in points.
+"""
+import functools
+import importlib.util
+import math
+import typing as t
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from src.datautils.challenge import Challenge
+from src.datautils.dates import parse_date, day_to_date
+from src.datautils.downsample import lttb
+from src.datautils.estimators import fit_trend, DEFAULT_ESTIMATOR
+from src.datautils.images import encode_image
+from src.datautils.render import RenderProfile, render_profiles, DEFAULT_RENDER_PROFILE
+
+# Drawn this many times larger and scaled down: Pillow does not antialias shapes
+SUPERSAMPLING = 2
+
+RECORDS_COLOR = '#1f77b4'
+CHALLENGE_COLOR = 'red'
+GRID_COLOR = '#b0b0b0'
+
+# matplotlib defaults, in points
+FONT_SIZE = 10
+LINE_WIDTH = 1.5
+AXES_LINE_WIDTH = 0.8
+TICK_LENGTH = 3.5
+TICK_PAD = 3.5
+LABEL_PAD = 4
+LAYOUT_PAD = 1.08 * FONT_SIZE
+MARKER_SIZE = 6
+# Marker of 6 points across, and half of its 1 point edge
+SCATTER_RADIUS = 3.5
+DASH_PATTERN = 3.7 * LINE_WIDTH, 1.6 * LINE_WIDTH
+MARGIN = 0.05
+"""Of the data range, added on each side of automatic limits"""
+TICK_STEPS = 1, 2, 2.5, 5, 10
+MAX_TICK_BINS = 9
+
+
+@functools.lru_cache(maxsize=None)
+def _font_path() -> t.Optional[str]:
+    # The font matplotlib draws with, found without importing matplotlib
+    spec = importlib.util.find_spec('matplotlib')
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    path = Path(spec.submodule_search_locations[0]) / 'mpl-data' / 'fonts' / 'ttf' / 'DejaVuSans.ttf'
+    return str(path) if path.exists() else None
+
+
+@functools.lru_cache(maxsize=8)
+def _font(size_px: int) -> ImageFont.ImageFont:
+    if (path := _font_path()) is None:
+        return ImageFont.load_default()
+    return ImageFont.truetype(path, size_px)
+
+
+def _to_days(date: t.Sequence[datetime] | np.ndarray) -> np.ndarray:
+    """Fractional day numbers, the same values as matplotlib's date2num()."""
+    microseconds = np.asarray(date, dtype='datetime64[us]').astype(np.int64)
+    return microseconds / (24 * 3600 * 10 ** 6)
+
+
+def _ticks(low: float, high: float, bins: int) -> np.ndarray:
+    """Ticks within [low, high], as matplotlib's MaxNLocator(steps=TICK_STEPS) puts them."""
+    if high <= low:
+        return np.array([low])
+    raw_step = (high - low) / bins
+    scale = 10 ** math.floor(math.log10(raw_step))
+    step = next(step * scale for step in TICK_STEPS if step * scale >= raw_step)
+    first, last = math.ceil(low / step - 1e-9), math.floor(high / step + 1e-9)
+    return np.arange(first, last + 1) * step
+
+
+def _format_y_tick(value: float) -> str:
+    return f'{value:g}' if value != int(value) else str(int(value))
+
+
+def _format_x_tick(value: float) -> str:
+    return day_to_date(math.floor(value)).strftime('%d %b')
+
+
+def _auto_limits(values: t.Sequence[float], default: tuple[float, float]) -> tuple[float, float]:
+    if len(values) == 0:
+        return default
+    low, high = min(values), max(values)
+    if low == high:
+        low, high = low - 1, high + 1
+    margin = (high - low) * MARGIN
+    return low - margin, high + margin
+
+
+class _Canvas:
+    """Pixel drawing in points, with data to pixel mapping once the axes are placed."""
+
+    def __init__(self, profile: RenderProfile):
+        self.scale = profile.dpi * SUPERSAMPLING / 72
+        self.width = round(profile.figsize[0] * profile.dpi) * SUPERSAMPLING
+        self.height = round(profile.figsize[1] * profile.dpi) * SUPERSAMPLING
+        self.image = Image.new('RGB', (self.width, self.height), 'white')
+        self.draw = ImageDraw.Draw(self.image)
+        self.font = _font(round(FONT_SIZE * self.scale))
+        self.box = 0, 0, self.width, self.height
+        self.x_limits = self.y_limits = (0.0, 1.0)
+
+    def px(self, points: float) -> float:
+        return points * self.scale
+
+    def text_size(self, text: str) -> tuple[int, int]:
+        left, top, right, bottom = self.font.getbbox(text)
+        return right - left, bottom - top
+
+    def text(self, text: str, anchor_xy: tuple[float, float], color: str = 'black', rotation: float = 0,
+             ha: str = 'center', va: str = 'top') -> None:
+        """Draw text whose (rotated) bounding box is aligned to anchor_xy like matplotlib's ha / va."""
+        left, top, right, bottom = self.font.getbbox(text)
+        label = Image.new('L', (right - left, bottom - top))
+        ImageDraw.Draw(label).text((-left, -top), text, font=self.font, fill=255)
+        if rotation:
+            label = label.rotate(rotation, resample=Image.Resampling.BICUBIC, expand=True)
+        x, y = anchor_xy
+        x -= {'left': 0, 'center': label.width / 2, 'right': label.width}[ha]
+        y -= {'top': 0, 'center': label.height / 2, 'bottom': label.height}[va]
+        self.image.paste(Image.new('RGB', label.size, color), (round(x), round(y)), label)
+
+    def to_px(self, x: np.ndarray | float, y: np.ndarray | float) -> tuple[np.ndarray, np.ndarray]:
+        left, top, right, bottom = self.box
+        (x_low, x_high), (y_low, y_high) = self.x_limits, self.y_limits
+        return (left + (np.asarray(x) - x_low) / (x_high - x_low) * (right - left),
+                bottom - (np.asarray(y) - y_low) / (y_high - y_low) * (bottom - top))
+
+    def inside(self, x: float, y: float) -> bool:
+        return self.x_limits[0] <= x <= self.x_limits[1] and self.y_limits[0] <= y <= self.y_limits[1]
+
+
+def _place_axes(canvas: _Canvas, y_labels: list[str], x_labels: list[str], plot_label: str) -> None:
+    """Margins for the tick labels and the y label, as tight_layout() leaves them."""
+    pad = canvas.px(LAYOUT_PAD)
+    tick_space = canvas.px(TICK_LENGTH + TICK_PAD)
+    y_labels_width = max((canvas.text_size(label)[0] for label in y_labels), default=0)
+    _, text_height = canvas.text_size('0')
+    # Rotated by 45 degrees, a date label takes (width + height) / sqrt(2) both ways
+    x_label_extent = max((sum(canvas.text_size(label)) / math.sqrt(2) for label in x_labels), default=0)
+
+    left = pad + canvas.text_size(plot_label)[1] + canvas.px(LABEL_PAD) + y_labels_width + tick_space
+    bottom = pad + x_label_extent + tick_space
+    right = pad + x_label_extent / 2
+    top = pad + text_height / 2
+    canvas.box = round(left), round(top), round(canvas.width - right), round(canvas.height - bottom)
+
+
+def _draw_axes(canvas: _Canvas, x_ticks: np.ndarray, y_ticks: np.ndarray, plot_label: str) -> None:
+    left, top, right, bottom = canvas.box
+    grid_width = max(1, round(canvas.px(AXES_LINE_WIDTH)))
+    tick_length = canvas.px(TICK_LENGTH)
+    tick_pad = canvas.px(TICK_LENGTH + TICK_PAD)
+
+    xs, _ = canvas.to_px(x_ticks, 0)
+    for x, tick in zip(xs, x_ticks):
+        canvas.draw.line([(x, top), (x, bottom)], fill=GRID_COLOR, width=grid_width)
+        canvas.draw.line([(x, bottom), (x, bottom + tick_length)], fill='black', width=grid_width)
+        canvas.text(_format_x_tick(tick), (x, bottom + tick_pad), rotation=45)
+
+    _, ys = canvas.to_px(0, y_ticks)
+    y_labels_width = 0
+    for y, tick in zip(ys, y_ticks):
+        canvas.draw.line([(left, y), (right, y)], fill=GRID_COLOR, width=grid_width)
+        canvas.draw.line([(left - tick_length, y), (left, y)], fill='black', width=grid_width)
+        label = _format_y_tick(tick)
+        y_labels_width = max(y_labels_width, canvas.text_size(label)[0])
+        canvas.text(label, (left - tick_pad, y), ha='right', va='center')
+
+    canvas.text(plot_label, (left - tick_pad - y_labels_width - canvas.px(LABEL_PAD), (top + bottom) / 2),
+                rotation=90, ha='right', va='center')
+
+
+def _clip(start: tuple[float, float], end: tuple[float, float], box: tuple[int, int, int, int]) \
+        -> t.Optional[tuple[float, float]]:
+    """:return: the part of the segment inside the box, as fractions of its length; None if it misses the box"""
+    low, high = 0.0, 1.0
+    for origin, delta, box_low, box_high in ((start[0], end[0] - start[0], box[0], box[2]),
+                                             (start[1], end[1] - start[1], box[1], box[3])):
+        if delta == 0:
+            if not box_low <= origin <= box_high:
+                return None
+            continue
+        enter, leave = sorted(((box_low - origin) / delta, (box_high - origin) / delta))
+        low, high = max(low, enter), min(high, leave)
+    return (low, high) if low < high else None
+
+
+def _dashed_line(draw: ImageDraw.ImageDraw, start: tuple[float, float], end: tuple[float, float],
+                 dash: tuple[float, float], box: tuple[int, int, int, int], fill: str, width: int) -> None:
+    """Dashes from start, drawn where they are inside the box."""
+    if (clipped := _clip(start, end, box)) is None:
+        return
+    length = math.dist(start, end)
+    direction = (end[0] - start[0]) / length, (end[1] - start[1]) / length
+    visible_from, visible_to = clipped[0] * length, clipped[1] * length
+    on, off = dash
+    # The first dash that reaches into the box
+    position = max(0.0, (visible_from // (on + off)) * (on + off))
+    while position < visible_to:
+        dash_start, dash_end = max(position, visible_from), min(position + on, visible_to)
+        if dash_start < dash_end:
+            draw.line([(start[0] + direction[0] * dash_start, start[1] + direction[1] * dash_start),
+                       (start[0] + direction[0] * dash_end, start[1] + direction[1] * dash_end)],
+                      fill=fill, width=width)
+        position += on + off
+
+
+def _draw_data(canvas: _Canvas, x: np.ndarray, y: np.ndarray, trend_x: t.Optional[np.ndarray],
+               trend_y: t.Optional[np.ndarray], challenge_xy: t.Optional[tuple[list[float], list[float]]]) -> None:
+    """Records, trend and challenge lines. Only the challenge can reach out of the axes: it is clipped."""
+    draw = canvas.draw
+    line_width = round(canvas.px(LINE_WIDTH))
+
+    def to_px(xs, ys) -> list[tuple[float, float]]:
+        px, py = canvas.to_px(xs, ys)
+        return list(zip(px.tolist(), py.tolist()))
+
+    if challenge_xy is not None:
+        start, end = to_px(*challenge_xy)
+        _dashed_line(draw, start, end, (canvas.px(DASH_PATTERN[0]), canvas.px(DASH_PATTERN[1])), canvas.box,
+                     CHALLENGE_COLOR, line_width)
+        half = canvas.px(MARKER_SIZE / 2)
+        for (cx, cy), data_x, data_y in zip((start, end), *challenge_xy):
+            if canvas.inside(data_x, data_y):
+                for dx in (-half, half):
+                    draw.line([(cx - dx, cy - half), (cx + dx, cy + half)], fill=CHALLENGE_COLOR,
+                              width=round(canvas.px(1)))
+
+    radius = canvas.px(SCATTER_RADIUS)
+    for px, py in to_px(x, y):
+        draw.ellipse([px - radius, py - radius, px + radius, py + radius], fill=RECORDS_COLOR)
+
+    if trend_x is not None:
+        draw.line(to_px(trend_x, trend_y), fill=RECORDS_COLOR, width=line_width)
+
+    # Axes frame over the data, as matplotlib's spines
+    draw.rectangle(canvas.box, outline='black', width=max(1, round(canvas.px(AXES_LINE_WIDTH))))
+
+
+def draw_plot_bodymass_pillow(date: t.Sequence[datetime] | np.ndarray, mass: t.Sequence[float] | np.ndarray,
+                              file: str | t.BinaryIO, plot_label: str,
+                              challenge: Challenge | None = None,
+                              start_label: str = 'Start',
+                              target_label: str = 'Goal',
+                              date_limits: t.Optional[tuple[datetime, datetime]] = None,
+                              estimator: str = DEFAULT_ESTIMATOR,
+                              max_points: t.Optional[int] = None,
+                              profile: RenderProfile = render_profiles[DEFAULT_RENDER_PROFILE]) \
+        -> t.Optional[np.array]:
+    """Same as plotting.draw_plot_bodymass(), arguments and result, drawn with Pillow."""
+    x = _to_days(date)
+    y = np.asarray(mass, dtype=np.float64)
+    if date_limits:
+        limits = _to_days(date_limits)
+        fits_limits = (limits[0] <= x) & (x <= limits[1])
+        x, y = x[fits_limits], y[fits_limits]
+
+    challenge_xy = None
+    if challenge:
+        challenge_xy = ([float(_to_days([parse_date(challenge.start_date)])[0]),
+                         float(_to_days([parse_date(challenge.end_date)])[0])],
+                        [challenge.start_weight, challenge.target_weight])
+
+    canvas = _Canvas(profile)
+
+    # Limits as plotting._get_x_limits() and plotting._get_y_limits() set them, automatic ones as matplotlib does
+    if date_limits:
+        x_low, x_high = _to_days(date_limits)
+        if len(x) > 0:
+            x_low, x_high = max(x_low, x.min()) - 1, min(x_high, x.max()) + 1
+        canvas.x_limits = float(x_low), float(x_high)
+    else:
+        canvas.x_limits = _auto_limits(np.concatenate([x, challenge_xy[0] if challenge_xy else []]), (0.0, 1.0))
+    if len(y) > 0:
+        canvas.y_limits = y.min() // 5 * 5 - 6, y.max() // 5 * 5 + 6
+    elif challenge_xy is None:
+        canvas.y_limits = 64, 76
+    else:
+        canvas.y_limits = _auto_limits(challenge_xy[1], (0.0, 1.0))
+
+    # Tick space as matplotlib reckons it: 3 font sizes per x tick, 2 per y tick, in points of the axes length
+    width_pt, height_pt = profile.figsize[0] * 72, profile.figsize[1] * 72
+    x_ticks = _ticks(*canvas.x_limits, min(MAX_TICK_BINS, max(1, int(width_pt * 0.88 // (FONT_SIZE * 3)))))
+    y_ticks = _ticks(*canvas.y_limits, min(MAX_TICK_BINS, max(1, int(height_pt * 0.82 // (FONT_SIZE * 2)))))
+    _place_axes(canvas, [_format_y_tick(tick) for tick in y_ticks], [_format_x_tick(tick) for tick in x_ticks],
+                plot_label)
+    _draw_axes(canvas, x_ticks, y_ticks, plot_label)
+
+    regression_coef = None
+    trend_line = fit_trend(x, y, estimator)
+
+    if max_points is not None:
+        kept = lttb(x, y, max_points)
+        x, y = x[kept], y[kept]
+
+    trend_x = trend_y = None
+    if trend_line is not None:
+        regression_coef = np.array([trend_line.slope, trend_line.intercept])
+        trend_x = np.array([x.min(), x.max()])
+        trend_y = trend_line(trend_x)
+
+    _draw_data(canvas, x, y, trend_x, trend_y, challenge_xy)
+
+    if challenge_xy is not None:
+        offset = canvas.px(5)
+        for label, cx, cy in zip((start_label, target_label), *challenge_xy):
+            # Annotations of points outside the axes are not drawn, as in matplotlib
+            if canvas.inside(cx, cy):
+                px, py = canvas.to_px(cx, cy)
+                canvas.text(label, (float(px), float(py) + offset), color=CHALLENGE_COLOR)
+
+    image = canvas.image.reduce(SUPERSAMPLING)
+    encode_image(image, file, profile)
+    return regression_coef
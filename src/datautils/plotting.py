@@ -0,0 +1,200 @@
+import typing as t
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+from matplotlib.artist import Artist
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.dates import date2num, DateFormatter
+from matplotlib.figure import Figure
+from matplotlib.transforms import Bbox
+
+from src.datautils.challenge import Challenge
+from src.datautils.dates import parse_date
+from src.datautils.downsample import lttb
+from src.datautils.estimators import fit_trend, DEFAULT_ESTIMATOR
+from src.datautils.images import encode_image
+from src.datautils.render import RenderProfile, render_profiles, DEFAULT_RENDER_PROFILE
+
+# Color of the records and of their trend line: the first color of the default cycle, as pyplot picked it
+RECORDS_COLOR = 'C0'
+
+
+def desired_regression(challenge: Challenge):
+    y = challenge.start_weight, challenge.target_weight
+    x = list(map(date2num, [parse_date(challenge.start_date), parse_date(challenge.end_date)]))
+    coef = np.polyfit(x, y, 1)
+    func = np.poly1d(coef)
+    return x, func(x)
+
+
+class BodymassRenderer:
+    """Draws body mass plots on one figure, set up once and reused.
+
+    Axes, date formatter, grid and layout stay in place between plots; a plot only replaces the records, trend and
+    challenge artists. No pyplot: nothing global is touched, but a renderer is not thread safe either, so each
+    render worker has its own per profile (see get_renderer()).
+    """
+
+    def __init__(self, profile: RenderProfile = render_profiles[DEFAULT_RENDER_PROFILE]):
+        self.profile = profile
+        self.figure, self.ax = self._new_figure()
+        self._artists: list[Artist] = []
+        # tight_layout() draws a whole figure to measure it: it is computed once per y label and tick label width
+        self._layouts: dict[tuple[str, int], dict[str, float]] = {}
+
+    def _new_figure(self) -> tuple[Figure, Axes]:
+        figure = Figure(figsize=self.profile.figsize, dpi=self.profile.dpi)
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot()
+        ax.xaxis.set_major_formatter(DateFormatter('%d %b'))
+        ax.tick_params(axis='x', labelrotation=45)
+        ax.grid()
+        return figure, ax
+
+    def draw(self, date: t.Sequence[datetime] | np.ndarray, mass: t.Sequence[float] | np.ndarray,
+             file: str | t.BinaryIO, plot_label: str,
+             challenge: Challenge | None = None,
+             start_label: str = 'Start',
+             target_label: str = 'Goal',
+             date_limits: t.Optional[tuple[datetime, datetime]] = None,
+             estimator: str = DEFAULT_ESTIMATOR,
+             max_points: t.Optional[int] = None) -> t.Optional[np.array]:
+        """See draw_plot_bodymass()."""
+        x = date2num(np.asarray(date))
+        y = np.asarray(mass, dtype=np.float64)
+        if date_limits:
+            fits_limits = (date2num(date_limits[0]) <= x) & (x <= date2num(date_limits[1]))
+            x, y = x[fits_limits], y[fits_limits]
+
+        self._clear()
+        ax = self.ax
+
+        if challenge:
+            self._draw_challenge(challenge, start_label, target_label)
+
+        if x_limits := _get_x_limits(date_limits, x):
+            ax.set_xlim(*x_limits)
+        if y_limits := _get_y_limits(challenge, y):
+            ax.set_ylim(*y_limits)
+
+        regression_coef = None
+        trend_line = fit_trend(x, y, estimator)
+
+        if max_points is not None:
+            kept = lttb(x, y, max_points)
+            x, y = x[kept], y[kept]
+        self._artists.append(ax.scatter(x, y, color=RECORDS_COLOR))
+
+        if trend_line is not None:
+            regression_coef = np.array([trend_line.slope, trend_line.intercept])
+            self._artists.extend(ax.plot(x, trend_line(x), color=RECORDS_COLOR))
+
+        ax.set_ylabel(plot_label)
+        self._apply_layout(plot_label)
+
+        self.encode(file)
+
+        return regression_coef
+
+    def encode(self, file: str | t.BinaryIO) -> None:
+        """Rasterize the current plot and write it in the profile's format."""
+        self.figure.canvas.draw()
+        image = Image.fromarray(np.asarray(self.figure.canvas.buffer_rgba())).convert('RGB')
+        encode_image(image, file, self.profile)
+
+    def _clear(self) -> None:
+        for artist in self._artists:
+            artist.remove()
+        self._artists.clear()
+        # Limits of the previous plot go with its artists: back to the limits of empty axes
+        self.ax.relim()
+        self.ax.viewLim.set_points(Bbox.unit().get_points())
+        self.ax.autoscale(True)
+
+    def _apply_layout(self, plot_label: str) -> None:
+        # Formatting the ticks does not need a draw, unlike measuring them
+        y_labels = self.ax.yaxis.get_major_formatter().format_ticks(self.ax.get_yticks())
+        width = max(map(len, y_labels), default=0)
+        if (layout := self._layouts.get((plot_label, width))) is None:
+            layout = self._layouts[plot_label, width] = self._measure_layout(plot_label, width)
+        self.figure.subplots_adjust(**layout)
+
+    def _measure_layout(self, plot_label: str, width: int) -> dict[str, float]:
+        """Margins for the widest tick labels a plot can get: `width` digits on y, a date tick at the right end of x."""
+        figure, ax = self._new_figure()
+        ax.set_ylabel(plot_label)
+        ax.set_yticks([0.5], ['0' * width])
+        ax.set_xlim(date2num(datetime(2000, 9, 21)), date2num(datetime(2000, 9, 28)))
+        figure.tight_layout()
+        return {name: getattr(figure.subplotpars, name) for name in ('left', 'bottom', 'right', 'top')}
+
+    def _draw_challenge(self, challenge: Challenge, start_label: str, target_label: str):
+        desired_x, desired_y = desired_regression(challenge)
+        self._artists.extend(self.ax.plot(desired_x, desired_y, linestyle='dashed', color='red',
+                                          markevery=[0, -1], marker='x'))
+
+        def annotate(label: str, x_, y_):
+            self._artists.append(self.ax.annotate(label, (x_, y_), color='red', ha='center', va='top',
+                                                  xytext=(0, -5), textcoords="offset points"))
+
+        annotate(f'{start_label}', desired_x[0], desired_y[0])
+        annotate(f'{target_label}', desired_x[1], desired_y[1])
+
+
+_renderers: dict[RenderProfile, BodymassRenderer] = {}
+
+
+def get_renderer(profile: RenderProfile = render_profiles[DEFAULT_RENDER_PROFILE]) -> BodymassRenderer:
+    """The renderer of this process for a profile, created on first use."""
+    if (renderer := _renderers.get(profile)) is None:
+        renderer = _renderers[profile] = BodymassRenderer(profile)
+    return renderer
+
+
+def draw_plot_bodymass(date: t.Sequence[datetime] | np.ndarray, mass: t.Sequence[float] | np.ndarray,
+                       file: str | t.BinaryIO, plot_label: str,
+                       challenge: Challenge | None = None,
+                       start_label: str = 'Start',
+                       target_label: str = 'Goal',
+                       date_limits: t.Optional[tuple[datetime, datetime]] = None,
+                       estimator: str = DEFAULT_ESTIMATOR,
+                       max_points: t.Optional[int] = None,
+                       profile: RenderProfile = render_profiles[DEFAULT_RENDER_PROFILE]) -> t.Optional[np.array]:
+    """Draw body mass records and their trend line to an image, PNG or JPEG as the render profile says.
+
+    Dates can be datetime objects or a datetime64 array. With max_points, longer series are downsampled
+    for the scatter only: the trend line is fitted to every record.
+
+    :return: slope (kg/day) and intercept of the trend line, None if there is none
+    """
+    return get_renderer(profile).draw(date, mass, file, plot_label, challenge, start_label, target_label,
+                               date_limits, estimator, max_points)
+
+
+def _get_y_limits(challenge: t.Optional[Challenge], y: t.Sequence[float]) -> t.Sequence[float]:
+    """
+    :returns: arguments for Axes.set_ylim(), empty for automatic limits
+    """
+    if len(y) > 0:
+        return min(y) // 5 * 5 - 6, max(y) // 5 * 5 + 6
+    elif challenge is None:
+        return 64, 76
+    return []
+
+
+def _get_x_limits(date_limits: t.Optional[tuple[datetime, datetime]], x: t.Sequence[float]) -> t.Sequence[float]:
+    """
+    :returns: arguments for Axes.set_xlim(), empty for automatic limits
+    """
+    if not date_limits:
+        return []
+
+    min_x = date2num(date_limits[0])
+    max_x = date2num(date_limits[1])
+    if len(x) > 0:
+        min_x = max(min_x, min(x)) - 1
+        max_x = min(max_x, max(x)) + 1
+
+    return min_x, max_x
@@ -0,0 +1,195 @@
+import asyncio
+import contextlib
+import dataclasses
+import typing as t
+
+import aiosqlite
+from telebot import logger
+
+from src.datautils import sqlite_db_path
+
+
+@dataclasses.dataclass(frozen=True)
+class StorageProfile:
+    """Pragmas applied to every pooled connection. The defaults favour throughput:
+    readers do not block the writer, and a commit does not wait for fsync (only a checkpoint does).
+    A crash may lose the last commits, but never corrupts the database.
+    """
+    journal_mode: str = 'WAL'
+    synchronous: str = 'NORMAL'
+    mmap_size: int = 64 * 1024 * 1024
+    # Negative: in KiB, per connection
+    cache_size: int = -8 * 1024
+    temp_store: str = 'MEMORY'
+    busy_timeout_ms: int = 5000
+    # Periodic PRAGMA wal_checkpoint(PASSIVE), 0 to leave it to SQLite's auto-checkpoint
+    checkpoint_interval_s: float = 300
+
+    def pragmas(self) -> list[str]:
+        return [
+            f"PRAGMA journal_mode = {self.journal_mode}",
+            f"PRAGMA synchronous = {self.synchronous}",
+            f"PRAGMA mmap_size = {int(self.mmap_size)}",
+            f"PRAGMA cache_size = {int(self.cache_size)}",
+            f"PRAGMA temp_store = {self.temp_store}",
+            f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}",
+        ]
+
+
+storage_profiles: dict[str, StorageProfile] = {
+    'fast': StorageProfile(),
+    # Every commit is durable
+    'durable': StorageProfile(synchronous='FULL'),
+    # SQLite defaults: rollback journal, readers and the writer block each other
+    'sqlite_defaults': StorageProfile(journal_mode='DELETE', synchronous='FULL', mmap_size=0, cache_size=-2000,
+                                      temp_store='DEFAULT', busy_timeout_ms=0, checkpoint_interval_s=0),
+}
+
+
+@dataclasses.dataclass
+class PoolStats:
+    reader_hits: int = 0
+    reader_waits: int = 0
+    writer_hits: int = 0
+    writer_waits: int = 0
+    checkpoints: int = 0
+    checkpointed_pages: int = 0
+
+
+class ConnectionPool:
+    """Long-lived aiosqlite connections shared by every datautils coroutine.
+
+    Readers are handed out from a fixed set of connections, writes go through a single
+    connection guarded by a lock, so SQLite never sees two writers from this process.
+    """
+
+    def __init__(self, path: str = sqlite_db_path, readers: int = 2, profile: StorageProfile = StorageProfile()):
+        assert readers > 0, "at least one reader connection is required"
+        self.path = path
+        self.readers = readers
+        self.profile = profile
+        self.stats = PoolStats()
+
+        self._reader_connections: list[aiosqlite.Connection] = []
+        self._idle_readers: t.Optional[asyncio.Queue] = None
+        self._writer: t.Optional[aiosqlite.Connection] = None
+        self._writer_lock = asyncio.Lock()
+        self._checkpoint_task: t.Optional[asyncio.Task] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        connection = await aiosqlite.connect(self.path)
+        for pragma in self.profile.pragmas():
+            await connection.execute(pragma)
+        return connection
+
+    async def open(self) -> None:
+        assert not self.is_open, "pool is already open"
+        # The writer first: switching the journal mode needs the database to itself
+        writer = await self._connect()
+        self._idle_readers = asyncio.Queue()
+        for _ in range(self.readers):
+            connection = await self._connect()
+            self._reader_connections.append(connection)
+            self._idle_readers.put_nowait(connection)
+        self._writer = writer
+
+        if self.profile.checkpoint_interval_s > 0 and self.profile.journal_mode.upper() == 'WAL':
+            self._checkpoint_task = asyncio.create_task(self._checkpoint_loop())
+
+    async def close(self) -> None:
+        if not self.is_open:
+            return
+        if self._checkpoint_task is not None:
+            self._checkpoint_task.cancel()
+            self._checkpoint_task = None
+        async with self._writer_lock:
+            await self._writer.close()
+            self._writer = None
+        for connection in self._reader_connections:
+            await connection.close()
+        self._reader_connections = []
+        self._idle_readers = None
+
+    @contextlib.asynccontextmanager
+    async def reader(self) -> t.AsyncIterator[aiosqlite.Connection]:
+        assert self.is_open, "pool is not open"
+        if self._idle_readers.empty():
+            self.stats.reader_waits += 1
+        else:
+            self.stats.reader_hits += 1
+
+        connection = await self._idle_readers.get()
+        try:
+            yield connection
+        finally:
+            self._idle_readers.put_nowait(connection)
+
+    @contextlib.asynccontextmanager
+    async def writer(self) -> t.AsyncIterator[aiosqlite.Connection]:
+        """Serialized access to the writer connection. Uncommitted changes are rolled back on error."""
+        assert self.is_open, "pool is not open"
+        if self._writer_lock.locked():
+            self.stats.writer_waits += 1
+        else:
+            self.stats.writer_hits += 1
+
+        async with self._writer_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+    async def checkpoint(self) -> int:
+        """Copy committed pages from the WAL file back to the database, without waiting for readers.
+
+        :return: number of pages checkpointed
+        """
+        async with self.writer() as db:
+            async with db.execute("PRAGMA wal_checkpoint(PASSIVE)") as cursor:
+                _, _, checkpointed = await cursor.fetchone()
+        self.stats.checkpoints += 1
+        self.stats.checkpointed_pages += max(checkpointed, 0)
+        return checkpointed
+
+    async def _checkpoint_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.profile.checkpoint_interval_s)
+            try:
+                await self.checkpoint()
+            except Exception as exception:
+                logger.error("WAL checkpoint failed: %s: %s", type(exception).__name__, exception)
+
+
+_pool: t.Optional[ConnectionPool] = None
+
+
+async def open_pool(path: str = sqlite_db_path, readers: int = 2,
+                    profile: StorageProfile = StorageProfile()) -> ConnectionPool:
+    """Create the shared pool. Called once at bot startup."""
+    global _pool
+    assert _pool is None, "connection pool is already open"
+    pool = ConnectionPool(path, readers, profile)
+    await pool.open()
+    _pool = pool
+    return pool
+
+
+async def close_pool() -> t.Optional[PoolStats]:
+    """Close the shared pool. Returns its final counters."""
+    global _pool
+    if _pool is None:
+        return None
+    pool, _pool = _pool, None
+    await pool.close()
+    return pool.stats
+
+
+def get_pool() -> ConnectionPool:
+    if _pool is None:
+        raise RuntimeError("Connection pool is not open. Call open_pool() at startup.")
+    return _pool
@@ -0,0 +1,62 @@
+"""Every SQL statement the bot runs, as constant text with `?` parameters.
+
+The text of a statement never depends on the user or on values, so sqlite3's per-connection statement cache
+hands back the already prepared statement instead of parsing and planning it again.
+"""
+
+sqlite_db_users_mass = 'users_mass'
+sqlite_db_users_mass_stats = 'users_mass_stats'
+sqlite_db_users_challenges = 'users_challenges'
+sqlite_db_users_context = 'users_context'
+
+# users_mass: (user_id, day, body_mass)
+
+INSERT_BODYMASS = f"INSERT INTO {sqlite_db_users_mass} (user_id, day, body_mass) VALUES (?, ?, ?)"
+
+DELETE_USER_BODYMASS = f"DELETE FROM {sqlite_db_users_mass} WHERE user_id = ?"
+
+SELECT_USER_BODYMASS = f"SELECT day, body_mass FROM {sqlite_db_users_mass} " \
+                       f"WHERE user_id = ? ORDER BY day ASC"
+
+# Sequential scan of a primary key range: the table is clustered by (user_id, day)
+SELECT_USER_BODYMASS_RANGE = f"SELECT day, body_mass FROM {sqlite_db_users_mass} " \
+                             f"WHERE user_id = ? AND day BETWEEN ? AND ? ORDER BY day ASC"
+
+SELECT_USER_BODYMASS_DAY = f"SELECT day, body_mass FROM {sqlite_db_users_mass} WHERE user_id = ? AND day = ?"
+
+SELECT_USER_BODYMASS_DAYS_RANGE = f"SELECT day, body_mass FROM {sqlite_db_users_mass} " \
+                                  f"WHERE user_id = ? AND day BETWEEN ? AND ?"
+
+# users_mass_stats: (user_id, n, sum_x, sum_y, sum_xy, sum_xx) over users_mass, x being the day and y the body mass
+
+SELECT_USER_STATS = f"SELECT n, sum_x, sum_y, sum_xy, sum_xx FROM {sqlite_db_users_mass_stats} WHERE user_id = ?"
+
+ADD_USER_STATS = f"INSERT INTO {sqlite_db_users_mass_stats} (user_id, n, sum_x, sum_y, sum_xy, sum_xx) " \
+                 f"VALUES (?, ?, ?, ?, ?, ?) " \
+                 f"ON CONFLICT (user_id) DO UPDATE SET n = n + excluded.n, sum_x = sum_x + excluded.sum_x, " \
+                 f"sum_y = sum_y + excluded.sum_y, sum_xy = sum_xy + excluded.sum_xy, " \
+                 f"sum_xx = sum_xx + excluded.sum_xx"
+
+DELETE_USER_STATS = f"DELETE FROM {sqlite_db_users_mass_stats} WHERE user_id = ?"
+
+# users_challenges: (user_id, is_active, start_date, end_date, start_weight, target_weight)
+
+SELECT_USER_CHALLENGES = f"SELECT user_id, is_active, start_date, end_date, start_weight, target_weight " \
+                         f"FROM {sqlite_db_users_challenges} WHERE user_id = ?"
+
+INSERT_CHALLENGE = f"INSERT INTO {sqlite_db_users_challenges} " \
+                   f"(user_id, is_active, start_date, end_date, start_weight, target_weight) " \
+                   f"VALUES (?, ?, ?, ?, ?, ?)"
+
+DELETE_USER_CHALLENGES = f"DELETE FROM {sqlite_db_users_challenges} WHERE user_id = ?"
+
+# users_context: (user_id, conversation_state, language, challenge_draft, text_only)
+
+SELECT_USER_CONTEXT = f"SELECT conversation_state, language, challenge_draft, text_only " \
+                      f"FROM {sqlite_db_users_context} WHERE user_id = ?"
+
+UPSERT_USER_CONTEXT = f"INSERT INTO {sqlite_db_users_context} " \
+                      f"(user_id, conversation_state, language, challenge_draft, text_only) VALUES (?, ?, ?, ?, ?) " \
+                      f"ON CONFLICT (user_id) DO UPDATE SET conversation_state = excluded.conversation_state, " \
+                      f"language = excluded.language, challenge_draft = excluded.challenge_draft, " \
+                      f"text_only = excluded.text_only"
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import io
+import multiprocessing
+import time
+import typing as t
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from telebot import logger
+
+from src.datautils import lazy_import
+from src.datautils.challenge import Challenge
+from src.datautils.downsample import DEFAULT_MAX_PLOT_POINTS
+from src.datautils.estimators import DEFAULT_ESTIMATOR
+
+np = lazy_import('numpy')
+
+
+@dataclasses.dataclass(frozen=True)
+class RenderProfile:
+    """Size and encoding of the plot images."""
+    figsize: tuple[float, float] = (8, 5)
+    """inches"""
+    dpi: int = 300
+    image_format: t.Literal['png', 'jpeg'] = 'png'
+    png_compress_level: int = 6
+    """zlib level, 0-9"""
+    palette_colors: t.Optional[int] = None
+    """Quantize PNG images to this many colors: a plot is a few flat colors, the palette image is much smaller"""
+    jpeg_quality: int = 85
+
+
+# Telegram scales photos down to 1280 px on the long side and sends them as JPEG anyway
+render_profiles: dict[str, RenderProfile] = {
+    # As plots were always drawn: 2400x1500 PNG
+    'original': RenderProfile(),
+    'telegram': RenderProfile(dpi=160, palette_colors=64),
+    'telegram_jpeg': RenderProfile(dpi=160, image_format='jpeg'),
+    'small': RenderProfile(dpi=100, png_compress_level=9, palette_colors=16),
+}
+DEFAULT_RENDER_PROFILE = 'telegram'
+
+# 'pillow' draws without matplotlib, see pillow_plotting
+PLOT_RENDERERS = 'matplotlib', 'pillow'
+
+
+@dataclasses.dataclass
+class RenderJob:
+    """Everything a render worker needs. Must stay picklable: it is sent to another process."""
+    dates: np.ndarray
+    masses: np.ndarray
+    plot_label: str
+    challenge: t.Optional[Challenge] = None
+    date_limits: t.Optional[tuple[datetime, datetime]] = None
+    estimator: str = DEFAULT_ESTIMATOR
+    max_points: t.Optional[int] = None
+    """Scatter at most this many points, the render pool's max_points if None"""
+    profile: t.Optional[RenderProfile] = None
+    """The render pool's profile if None"""
+    renderer: str = 'matplotlib'
+    """One of PLOT_RENDERERS"""
+
+
+def render_job(job: RenderJob) -> tuple[bytes, t.Optional[np.ndarray], float]:
+    """Runs in a render worker.
+
+    :return: image, slope and intercept of the trend line, render time in seconds
+    """
+    # Imported here so that matplotlib is only loaded by the processes that draw, and only if they draw with it
+    if job.renderer == 'pillow':
+        from src.datautils.pillow_plotting import draw_plot_bodymass_pillow as draw_plot_bodymass
+    else:
+        from src.datautils.plotting import draw_plot_bodymass
+
+    started = time.perf_counter()
+    image = io.BytesIO()
+    regression_coef = draw_plot_bodymass(job.dates, job.masses, image, job.plot_label,
+                                         challenge=job.challenge,
+                                         date_limits=job.date_limits,
+                                         estimator=job.estimator,
+                                         max_points=job.max_points,
+                                         profile=job.profile or render_profiles[DEFAULT_RENDER_PROFILE])
+    return image.getvalue(), regression_coef, time.perf_counter() - started
+
+
+@dataclasses.dataclass
+class RenderStats:
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    restarts: int = 0
+    """Executors replaced after a worker died"""
+    render_seconds_total: float = 0.0
+    render_seconds_max: float = 0.0
+    wait_seconds_total: float = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        """Jobs submitted but not finished yet, including the ones being rendered."""
+        return self.submitted - self.completed - self.failed
+
+    @property
+    def render_seconds_mean(self) -> float:
+        return self.render_seconds_total / self.completed if self.completed else 0.0
+
+
+class RenderPool:
+    """Renders plots in worker processes, so that matplotlib does not block the event loop."""
+
+    def __init__(self, workers: int = 1):
+        assert workers > 0, "at least one render worker is required"
+        self.workers = workers
+        self.stats = RenderStats()
+        self._executor: t.Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        assert self._executor is None, "render pool is already started"
+        # Forking a process that runs event loop and sqlite threads is not safe
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        """Replace an executor that lost a worker: it fails every job from then on."""
+        # The jobs that failed together all come here, only the first one replaces it
+        if self._executor is not broken:
+            return
+        logger.error("A render worker died, restarting the render pool")
+        self.stats.restarts += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self.start()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, job: RenderJob) -> tuple[bytes, t.Optional[np.ndarray]]:
+        assert self._executor is not None, "render pool is not started"
+        self.stats.submitted += 1
+        started = time.perf_counter()
+        try:
+            executor = self._executor
+            try:
+                image, regression_coef, render_seconds = await asyncio.get_running_loop().run_in_executor(
+                    executor, render_job, job)
+            except BrokenProcessPool:
+                # A worker was killed, e.g. for memory: one more try with fresh workers
+                self._restart(executor)
+                image, regression_coef, render_seconds = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, render_job, job)
+        except BaseException:
+            self.stats.failed += 1
+            raise
+
+        self.stats.completed += 1
+        self.stats.render_seconds_total += render_seconds
+        self.stats.render_seconds_max = max(self.stats.render_seconds_max, render_seconds)
+        self.stats.wait_seconds_total += time.perf_counter() - started - render_seconds
+        return image, regression_coef
+
+
+_render_pool: t.Optional[RenderPool] = None
+_max_points = DEFAULT_MAX_PLOT_POINTS
+_profile = render_profiles[DEFAULT_RENDER_PROFILE]
+_two_week_renderer = 'matplotlib'
+_max_queue_depth: t.Optional[int] = None
+
+
+def start_render_pool(workers: int = 1, max_points: int = DEFAULT_MAX_PLOT_POINTS,
+                      profile: RenderProfile = render_profiles[DEFAULT_RENDER_PROFILE],
+                      two_week_renderer: str = 'matplotlib',
+                      max_queue_depth: t.Optional[int] = None) -> RenderPool:
+    """Start the render workers. Called once at bot startup.
+
+    :param max_queue_depth: jobs in flight from which the pool reports itself saturated, never if None
+    """
+    global _render_pool, _max_points, _profile, _two_week_renderer, _max_queue_depth
+    assert _render_pool is None, "render pool is already started"
+    if two_week_renderer not in PLOT_RENDERERS:
+        raise ValueError(f"unknown plot renderer {two_week_renderer!r}, expected one of {PLOT_RENDERERS}")
+    _max_points = max_points
+    _profile = profile
+    _two_week_renderer = two_week_renderer
+    _max_queue_depth = max_queue_depth
+    pool = RenderPool(workers)
+    pool.start()
+    _render_pool = pool
+    return pool
+
+
+def two_week_renderer() -> str:
+    """Renderer of the two-week plots, sent after every new record."""
+    return _two_week_renderer
+
+
+def render_pool_saturated() -> bool:
+    """Whether a new plot would wait behind max_queue_depth others: time to reply without one if possible."""
+    return (_render_pool is not None and _max_queue_depth is not None
+            and _render_pool.stats.queue_depth >= _max_queue_depth)
+
+
+def stop_render_pool() -> t.Optional[RenderStats]:
+    """Stop the render workers. Returns their counters."""
+    global _render_pool
+    if _render_pool is None:
+        return None
+    pool, _render_pool = _render_pool, None
+    pool.shutdown()
+    return pool.stats
+
+
+async def render_plot(job: RenderJob) -> tuple[bytes, t.Optional[np.ndarray]]:
+    """Render a plot in the render pool, or in this process if the pool has not been started (scripts, tests).
+
+    :return: image, slope and intercept of the drawn trend line
+    """
+    if job.max_points is None:
+        job = dataclasses.replace(job, max_points=_max_points)
+    if job.profile is None:
+        job = dataclasses.replace(job, profile=_profile)
+
+    if _render_pool is None:
+        image, regression_coef, _ = render_job(job)
+        return image, regression_coef
+
+    return await _render_pool.render(job)
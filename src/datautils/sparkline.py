@@ -0,0 +1,48 @@
+"""Body mass records as a line of Unicode blocks, for replies without an image.
+
+A sparkline is a few dozen bytes of caption where a plot is a rendered and uploaded photo: it costs no render worker
+and loads on any link.
+"""
+from __future__ import annotations
+
+from src.datautils import lazy_import
+from src.datautils.dates import date_column_to_days
+
+np = lazy_import('numpy')
+
+SPARKLINE_BLOCKS = '▁▂▃▄▅▆▇█'
+# Days without a record
+SPARKLINE_GAP = ' '
+# Wide enough for one block per day of a two-week plot, narrow enough not to wrap on a phone
+DEFAULT_SPARKLINE_WIDTH = 28
+
+
+def sparkline(dates: np.ndarray, masses: np.ndarray, width: int = DEFAULT_SPARKLINE_WIDTH) -> str:
+    """One block per day from the first record to the last, or per bucket of days if there are more than `width`.
+
+    A block is as high as the mean body mass of its days, from the lowest to the highest block; days without
+    records are gaps.
+
+    :param dates: datetime64[D] dates, ascending
+    :return: at most `width` characters, empty if there are no records
+    """
+    if len(masses) == 0:
+        return ''
+
+    days = date_column_to_days(dates)
+    days = days - days[0]
+    columns = min(int(days[-1]) + 1, width)
+    column = days * columns // (int(days[-1]) + 1)
+    counts = np.bincount(column, minlength=columns)
+    with np.errstate(invalid='ignore'):
+        means = np.bincount(column, masses, minlength=columns) / counts
+
+    low, high = np.nanmin(means), np.nanmax(means)
+    if high > low:
+        levels = np.rint((means - low) / (high - low) * (len(SPARKLINE_BLOCKS) - 1))
+    else:
+        # A flat line is drawn halfway up
+        levels = np.full(columns, len(SPARKLINE_BLOCKS) // 2 - 1)
+
+    return ''.join(SPARKLINE_GAP if count == 0 else SPARKLINE_BLOCKS[int(level)]
+                   for count, level in zip(counts, levels))
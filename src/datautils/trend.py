@@ -0,0 +1,119 @@
+"""Body mass trend: kg/week and mean, all-time or over a date window.
+
+Fits are lines with x in days, like the trend line of the plots. The all-time least squares trend comes from
+the sums kept in users_mass_stats, any other trend from a read of the records it covers.
+"""
+from __future__ import annotations
+
+import dataclasses
+import typing as t
+from datetime import datetime
+
+from src.datautils import queries, lazy_import
+from src.datautils.dates import date_limits_to_days, days_to_date_column, date_column_to_days
+from src.datautils.estimators import fit_trend, default_estimator, DEFAULT_ESTIMATOR
+from src.datautils.pool import get_pool
+
+np = lazy_import('numpy')
+
+# Fewer records than this in total and no speed is reported
+MIN_RECORDS_FOR_SPEED = 4
+
+
+@dataclasses.dataclass
+class RegressionSums:
+    """Least squares sums over body mass records, x being the day number and y the body mass.
+
+    Kept per user in users_mass_stats, so that the all-time trend does not need the records themselves.
+    """
+    n: int = 0
+    sum_x: int = 0
+    sum_y: float = 0.0
+    sum_xy: float = 0.0
+    sum_xx: int = 0
+
+    def add(self, rows: t.Iterable[tuple[int, float]], sign: int = 1) -> 'RegressionSums':
+        """Add (or with sign=-1 remove) (day, body mass) rows."""
+        for day, body_mass in rows:
+            self.n += sign
+            self.sum_x += sign * day
+            self.sum_y += sign * body_mass
+            self.sum_xy += sign * day * body_mass
+            self.sum_xx += sign * day * day
+        return self
+
+    @property
+    def mean(self) -> float:
+        return self.sum_y / self.n if self.n else float('nan')
+
+    @property
+    def slope(self) -> t.Optional[float]:
+        """kg/day of the least squares line, None if it is undefined."""
+        # Integer sums keep the denominator exact, it is where the cancellation would be
+        denominator = self.n * self.sum_xx - self.sum_x * self.sum_x
+        if self.n < 2 or denominator == 0:
+            return None
+        return (self.n * self.sum_xy - self.sum_x * self.sum_y) / denominator
+
+
+@dataclasses.dataclass(frozen=True)
+class Trend:
+    speed_kg_week: t.Optional[float]
+    mean_mass: float
+
+
+def speed_kg_week(slope: t.Optional[float], records_count: int) -> t.Optional[float]:
+    """Speed as shown in the captions: kg/week rounded to 10 g, None for a user with too few records."""
+    if slope is None or records_count < MIN_RECORDS_FOR_SPEED:
+        return None
+    return round(slope * 7, 2)
+
+
+def window_trend(dates: np.ndarray, masses: np.ndarray, sums: RegressionSums,
+                 estimator: str = DEFAULT_ESTIMATOR) -> Trend:
+    """Trend of the records of a window. The mean and the record count cutoff are all-time, as in the captions.
+
+    :param dates: datetime64[D] dates of the window records
+    """
+    line = fit_trend(date_column_to_days(dates), masses, estimator)
+    return Trend(speed_kg_week(line.slope if line is not None else None, sums.n), sums.mean)
+
+
+def all_time_trend(sums: RegressionSums) -> Trend:
+    return Trend(speed_kg_week(sums.slope, sums.n), sums.mean)
+
+
+async def fetch_user_regression_sums(user_id: int) -> RegressionSums:
+    """Sums over all user records: one row lookup, whatever the length of the history."""
+    async with get_pool().reader() as db:
+        async with db.execute(queries.SELECT_USER_STATS, (int(user_id),)) as cursor:
+            row = await cursor.fetchone()
+    return RegressionSums(*row) if row is not None else RegressionSums()
+
+
+async def fetch_user_trend(user_id: int, date_limits: t.Optional[tuple[datetime, datetime]] = None,
+                           estimator: t.Optional[str] = None,
+                           series: t.Optional[tuple[np.ndarray, np.ndarray]] = None) -> Trend:
+    """Trend of the plot and sparkline captions, without fetching more than the window's records.
+
+    :param estimator: key of trend_estimators, the deployment default if None
+    :param series: dates (datetime64[D]) and body masses of the records within date_limits, if already fetched
+    """
+    estimator = estimator or default_estimator()
+    sums = await fetch_user_regression_sums(user_id)
+    if date_limits is None and estimator == 'least_squares':
+        return all_time_trend(sums)
+
+    if series is None:
+        async with get_pool().reader() as db:
+            if date_limits is None:
+                cursor = await db.execute(queries.SELECT_USER_BODYMASS, (int(user_id),))
+            else:
+                cursor = await db.execute(queries.SELECT_USER_BODYMASS_RANGE,
+                                          (int(user_id), *date_limits_to_days(date_limits)))
+            async with cursor:
+                rows = await cursor.fetchall()
+        days, masses = zip(*rows) if rows else ((), ())
+        series = days_to_date_column(days), np.array(masses, dtype=np.float64)
+    return window_trend(*series, sums, estimator)
+
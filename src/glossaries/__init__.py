@@ -77,6 +77,18 @@ class Glossary:
     def here_plot_overall_progress(self) -> str:
         return self._module().HERE_PLOT_OVERALL_PROGRESS
 
+    def here_sparkline_last_two_weeks(self) -> str:
+        return self._module().HERE_SPARKLINE_LAST_TWO_WEEKS
+
+    def sparkline_template(self) -> str:
+        return self._module().SPARKLINE_TEMPLATE
+
+    def text_only_enabled(self) -> str:
+        return self._module().TEXT_ONLY_ENABLED
+
+    def text_only_disabled(self) -> str:
+        return self._module().TEXT_ONLY_DISABLED
+
     def no_data_to_download_yet(self) -> str:
         return self._module().NO_DATA_TO_DOWNLOAD_YET
 
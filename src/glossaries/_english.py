@@ -4,6 +4,7 @@ from src.datautils import date_format
 COMMAND_LIST = "/enter_weight - enter current weight\n\n" \
                "/plot - show plot (2 weeks) \n" \
                "/plot_all - show plot (all time) \n" \
+               "/text_only - plots as text (on / off) \n" \
                "/download - download data (*.csv) \n" \
                "/upload - upload data (*.csv)\n" \
                "/erase - erase all data \n" \
@@ -65,6 +66,15 @@ SUCCESSFULLY_ADDED_NEW_ENTRY = "Successfully added a new entry:"
 HERE_PLOT_LAST_TWO_WEEKS = "Here's a plot of your progress over the last two weeks.\n"
 HERE_PLOT_OVERALL_PROGRESS = "Here's a plot of your overall progress.\n"
 
+HERE_SPARKLINE_LAST_TWO_WEEKS = "Your progress over the last two weeks:\n"
+SPARKLINE_TEMPLATE = ("<code>{sparkline}</code>\n"
+                      "min <b>{min_mass:.1f}</b>, max <b>{max_mass:.1f}</b>, mean <b>{mean_mass:.1f}</b> kg\n")
+
+TEXT_ONLY_ENABLED = ("Text-only mode is on: instead of plots, I will send your progress as a line of text.\n"
+                     "/text_only - send plots again")
+TEXT_ONLY_DISABLED = ("Text-only mode is off: plots are back.\n"
+                      "/text_only - send plots as text")
+
 NO_DATA_TO_DOWNLOAD_YET = "You don't have any data to download yet.\n\n" \
                           "Use /enter_weight daily. \n" \
                           "Alternatively, use /upload to upload your existing data."
@@ -4,6 +4,7 @@ from src.datautils import date_format
 COMMAND_LIST = "/enter_weight - ввести текущий вес\n\n" \
                "/plot - показать график (за 2 недели) \n" \
                "/plot_all - показать график (за всё время) \n" \
+               "/text_only - графики текстом (вкл / выкл) \n" \
                "/download - скачать данные (*.csv) \n" \
                "/upload - загрузить данные в бота (*.csv)\n" \
                "/erase - стереть все данные \n" \
@@ -65,6 +66,15 @@ SUCCESSFULLY_ADDED_NEW_ENTRY = "Успешно добавлена новая з
 HERE_PLOT_LAST_TWO_WEEKS = "Вот график вашего прогресса за последние две недели.\n"
 HERE_PLOT_OVERALL_PROGRESS = "Вот график вашего общего прогресса.\n"
 
+HERE_SPARKLINE_LAST_TWO_WEEKS = "Ваш прогресс за последние две недели:\n"
+SPARKLINE_TEMPLATE = ("<code>{sparkline}</code>\n"
+                      "мин <b>{min_mass:.1f}</b>, макс <b>{max_mass:.1f}</b>, среднее <b>{mean_mass:.1f}</b> кг\n")
+
+TEXT_ONLY_ENABLED = ("Текстовый режим включён: вместо графиков я буду присылать ваш прогресс строкой текста.\n"
+                     "/text_only - снова присылать графики")
+TEXT_ONLY_DISABLED = ("Текстовый режим выключен: графики вернулись.\n"
+                      "/text_only - присылать графики текстом")
+
 NO_DATA_TO_DOWNLOAD_YET = "У вас пока нет данных для загрузки.\n\n" \
                           "Используйте команду /enter_weight ежедневно. \n" \
                           "Или, используйте команду /upload для загрузки существующих данных."
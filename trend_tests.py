@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from freezegun import freeze_time
+
+from db_tests import run_with_pool
+from src.datautils.bodymass import add_bodymass_record, plot_user_bodymass_data, sparkline_user_bodymass_data
+from src.datautils.estimators import least_squares, theil_sen, huber, exponentially_weighted, trend_estimators, \
+    THEIL_SEN_MAX_EXACT_POINTS
+from src.datautils.trend import fetch_user_trend, Trend
+
+TODAY = datetime(2023, 3, 8)
+
+
+def _history(days: int, seed: int) -> tuple[list[datetime], list[float]]:
+    rng = np.random.default_rng(seed)
+    dates = [TODAY - timedelta(days=day) for day in range(days) if rng.random() < 0.7]
+    masses = (80 + 0.05 * np.arange(len(dates)) + rng.normal(0, 0.4, len(dates))).round(1).tolist()
+    return dates, masses
+
+
+def test_least_squares():
+    rng = np.random.default_rng(1)
+    x = np.sort(rng.choice(np.arange(19000, 19400), 50, replace=False)).astype(np.float64)
+    y = 80 - 0.03 * x + rng.normal(0, 0.5, 50)
+    line = least_squares(x, y)
+    assert np.allclose([line.slope, line.intercept], np.polyfit(x, y, 1))
+    for estimator in trend_estimators.values():
+        assert estimator(x[:1], y[:1]) is None
+        assert estimator(np.full(3, 19000.0), y[:3]) is None
+
+
+def _typo_series(points: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    """-0.02 kg/day with noise, and one record in 20 typed without its decimal point (80.4 -> 804)."""
+    rng = np.random.default_rng(seed)
+    x = 19000 + np.arange(points, dtype=np.float64)
+    y = 90 - 0.02 * (x - 19000) + rng.normal(0, 0.3, points)
+    typos = rng.random(points) < 0.05
+    y[typos] *= 10
+    return x, y
+
+
+def test_robust_estimators_ignore_typos():
+    for points in (60, THEIL_SEN_MAX_EXACT_POINTS + 500):
+        x, y = _typo_series(points, 2)
+        # Typos all over the series barely tilt the least squares line, they lift it
+        assert least_squares(x, y)(x[0]) > 100
+        for estimator in (theil_sen, huber):
+            assert np.isclose(estimator(x, y).slope, -0.02, rtol=0.1), estimator.__name__
+            assert np.isclose(estimator(x, y)(x[0]), 90, atol=1)
+        # Sampled pairs are drawn the same way every time
+        assert theil_sen(x, y) == theil_sen(x.copy(), y.copy())
+
+
+def test_exponentially_weighted_follows_recent_records():
+    x = 19000 + np.arange(60, dtype=np.float64)
+    # Losing 0.1 kg/day for 30 days, then gaining 0.1 kg/day
+    y = 90 - 0.1 * np.minimum(x - 19000, 30) + 0.1 * np.maximum(x - 19030, 0)
+    assert abs(least_squares(x, y).slope) < 0.02
+    assert exponentially_weighted(x, y, half_life_days=7).slope > 0.05
+
+
+@freeze_time(TODAY)
+def test_trend_matches_plot_captions():
+    async def scenario():
+        for user_id, days in ((1, 60), (2, 10), (3, 3)):
+            for date, mass in zip(*_history(days, user_id)):
+                await add_bodymass_record(user_id, date, mass)
+
+        results = []
+        for user_id in (1, 2, 3, 4):
+            two_weeks = await plot_user_bodymass_data(user_id, only_two_weeks=True)
+            all_time = await plot_user_bodymass_data(user_id)
+            results.append((Trend(two_weeks.speed_kg_week, two_weeks.mean_mass),
+                            await fetch_user_trend(user_id, (TODAY - timedelta(days=14), TODAY)),
+                            Trend(all_time.speed_kg_week, all_time.mean_mass),
+                            await fetch_user_trend(user_id)))
+        return results
+
+    results = run_with_pool(scenario)
+    for plot_two_weeks, two_weeks, plot_all_time, all_time in results:
+        for expected, trend in ((plot_two_weeks, two_weeks), (plot_all_time, all_time)):
+            assert trend.speed_kg_week == expected.speed_kg_week
+            assert np.isclose(trend.mean_mass, expected.mean_mass, equal_nan=True)
+
+    # The speed is the one the plot trend line used to give: np.polyfit over the window, 2 decimals
+    dates, masses = _history(60, 1)
+    window = [(date, mass) for date, mass in zip(dates, masses) if date >= TODAY - timedelta(days=14)]
+    x = [(date - datetime(1970, 1, 1)).days for date, _ in window]
+    assert results[0][1].speed_kg_week == round(np.polyfit(x, [mass for _, mass in window], 1)[0] * 7, 2)
+    # Fewer than 4 records in total: no speed
+    assert results[2][1].speed_kg_week is None and results[2][3].speed_kg_week is None
+    assert results[3][3].speed_kg_week is None and np.isnan(results[3][3].mean_mass)
+
+
+@freeze_time(TODAY)
+def test_estimator_trend_matches_plot_captions():
+    async def scenario():
+        dates, masses = _history(60, 1)
+        masses[5] *= 10
+        for date, mass in zip(dates, masses):
+            await add_bodymass_record(1, date, mass)
+
+        results = []
+        for estimator in trend_estimators:
+            for date_limits in (None, (TODAY - timedelta(days=14), TODAY)):
+                plot = await plot_user_bodymass_data(1, only_two_weeks=date_limits is not None, estimator=estimator)
+                results.append((plot.speed_kg_week, (await fetch_user_trend(1, date_limits, estimator)).speed_kg_week))
+        return results
+
+    results = run_with_pool(scenario)
+    for plot_speed, trend_speed in results:
+        assert plot_speed == trend_speed
+    # The typo drags the least squares lines only
+    least_squares_speeds = results[0][0], results[1][0]
+    for estimator, (all_time, _), (two_weeks, _) in zip(trend_estimators, results[::2], results[1::2]):
+        if estimator in ('theil_sen', 'huber'):
+            assert (all_time, two_weeks) != least_squares_speeds
+
+
+@freeze_time(TODAY)
+def test_sparkline_matches_plot_captions():
+    async def scenario():
+        for date, mass in zip(*_history(60, 1)):
+            await add_bodymass_record(1, date, mass)
+
+        results = []
+        for estimator in ('least_squares', 'theil_sen'):
+            for only_two_weeks in (False, True):
+                plot = await plot_user_bodymass_data(1, only_two_weeks=only_two_weeks, estimator=estimator)
+                summary = await sparkline_user_bodymass_data(1, only_two_weeks=only_two_weeks, estimator=estimator)
+                results.append((plot, summary))
+        return results, await sparkline_user_bodymass_data(2)
+
+    results, empty = run_with_pool(scenario)
+    for plot, summary in results:
+        assert summary.trend.speed_kg_week == plot.speed_kg_week
+        assert np.isclose(summary.trend.mean_mass, plot.mean_mass)
+
+    dates, masses = _history(60, 1)
+    window = [mass for date, mass in zip(dates, masses) if date >= TODAY - timedelta(days=14)]
+    two_weeks = results[1][1]
+    assert (two_weeks.min_mass, two_weeks.max_mass) == (min(window), max(window))
+    assert np.isclose(two_weeks.mean_mass, np.mean(window))
+    assert len(two_weeks.sparkline) == 15
+    assert empty.sparkline == '' and empty.trend.speed_kg_week is None and np.isnan(empty.min_mass)
+
+
+if __name__ == "__main__":
+    test_least_squares()
+    test_robust_estimators_ignore_typos()
+    test_exponentially_weighted_follows_recent_records()
+    test_trend_matches_plot_captions()
+    test_estimator_trend_matches_plot_captions()
+    test_sparkline_matches_plot_captions()